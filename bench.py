@@ -0,0 +1,254 @@
+import argparse, gc, json, os, platform, tracemalloc
+from time import perf_counter
+import src.builtin, src.memo
+import src.libs.output as output
+from src.lexer import Tokenizer
+from src.parse import Parser
+from src.optimizer import Optimizer, Pass
+from src.interpreter import Interpreter
+from src.vm import VM
+from src.closures import ClosureInterpreter, run_deep
+from src.cache import interpreter_version
+
+CORPUS = os.path.join('lang', 'bench')
+
+ENGINES = {
+    "tree": Interpreter,
+    "vm": VM,
+    "closure": ClosureInterpreter,
+}
+
+##########################################
+##                                      ##
+##  Synthetic Sources                   ##
+##                                      ##
+##########################################
+
+def flat_source(size: int) -> str:
+    # One long run of statements, mostly lexing and parsing
+    lines = ["let v0 = 0;"]
+    for index in range(1, size):
+        lines.append(f"let v{index} = v{index - 1} + {index} * 2 - {index % 7};")
+    lines.append(f"print(v{size - 1})")
+    return '\n'.join(lines)
+
+def functions_source(size: int) -> str:
+    # Many small functions, each defined once and called once
+    lines = []
+    for index in range(size):
+        lines.append(f"fn f{index}(x, y) {{ let z = x * y; if z > {index} {{ let z = z - {index} }}; z + 1 }};")
+    lines.append("let t = 1;")
+    for index in range(size):
+        lines.append(f"let t = f{index}(t, 2) - t;")
+    lines.append("print(t)")
+    return '\n'.join(lines)
+
+def nested_source(size: int) -> str:
+    # Scopes nested inside each other, as deep as size / 20
+    depth = max(1, size // 20)
+    lines = ["let total = 0;"]
+    for index in range(depth):
+        lines.append(' ' * index + f"if true {{ let a{index} = {index}; let total = total + a{index};")
+    lines.append(' ' * depth + "print(total)")
+    for index in reversed(range(depth)):
+        lines.append(' ' * index + "}")
+    return '\n'.join(lines)
+
+GENERATORS = {
+    "flat": flat_source,
+    "functions": functions_source,
+    "nested": nested_source,
+}
+
+##########################################
+##                                      ##
+##  Measuring                           ##
+##                                      ##
+##########################################
+
+class TokenList:
+    # Hands the parser tokens that were lexed beforehand, so parsing is timed
+    # on its own. Errors are still located through the real tokenizer.
+    def __init__(self, tokenizer: Tokenizer, tokens: list) -> None:
+        self.tokenizer = tokenizer
+        self.list = tokens
+
+    def tokens(self, filename: str | list | tuple = ''):
+        return iter(self.list)
+
+    def locate(self, oindex: int):
+        return self.tokenizer.locate(oindex)
+
+class CallCounter(Interpreter):
+    # Counts every call the program makes, builtins included
+    calls = 0
+
+    def visit_Call(self, node):
+        self.calls += 1
+        return super().visit_Call(node)
+
+class NullSink:
+    # Swallows what the programs print
+    def write(self, text: str) -> None:
+        pass
+
+def count_nodes(tree) -> int:
+    counter = Pass()
+    counter.run(tree)
+    return counter.visited
+
+def measure(function, setup = None, repeat: int = 5) -> float:
+    # Best of repeat runs. setup is not timed, its result is handed to function.
+    best = None
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        enabled = gc.isenabled()
+        gc.disable()
+        start = perf_counter()
+        function(argument)
+        seconds = perf_counter() - start
+        if enabled:
+            gc.enable()
+        if best is None or seconds < best:
+            best = seconds
+    return best
+
+def peak_memory(function, setup = None) -> int:
+    # Bytes allocated at the high point of one run, apart from setup
+    argument = setup() if setup else None
+    tracemalloc.start()
+    try:
+        function(argument)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def stage(function, setup, repeat: int, memory: bool, count: int = None, unit: str = None) -> dict:
+    result = {"seconds": measure(function, setup, repeat)}
+    if count is not None:
+        result[unit + "_per_second"] = count / result["seconds"] if result["seconds"] else 0.0
+    if memory:
+        result["peak_bytes"] = peak_memory(function, setup)
+    return result
+
+def bench_workload(name: str, source: str, engines: list, repeat: int, memory: bool) -> dict:
+    def lex(_):
+        return Tokenizer(source).tokenize(name)
+
+    tokenizer = Tokenizer(source)
+    tokens = tokenizer.tokenize(name)
+
+    def parse(_):
+        return Parser(TokenList(tokenizer, tokens)).parse(name)
+
+    def optimize(tree):
+        return Optimizer().optimize(tree)
+
+    def fresh_tree():
+        return Optimizer().optimize(parse(None))
+
+    nodes = count_nodes(parse(None))
+    counter = CallCounter(fresh_tree())
+    counter.interpret(name)
+
+    result = {
+        "name": name,
+        "tokens": len(tokens),
+        "nodes": nodes,
+        "calls": counter.calls,
+        "stages": {
+            "lex": stage(lex, None, repeat, memory, len(tokens), "tokens"),
+            "parse": stage(parse, None, repeat, memory, nodes, "nodes"),
+            "optimize": stage(optimize, lambda: parse(None), repeat, memory, nodes, "nodes"),
+        },
+    }
+    for engine in engines:
+        def run(tree, engine_type = ENGINES[engine]):
+            engine_type(tree).interpret(name)
+        result["stages"]["run:" + engine] = stage(run, fresh_tree, repeat, memory, counter.calls, "calls")
+    return result
+
+##########################################
+##                                      ##
+##  Report                              ##
+##                                      ##
+##########################################
+
+def throughput(values: dict) -> str:
+    for key, value in values.items():
+        if key.endswith("_per_second"):
+            unit = key[:-len('_per_second')] + '/s'
+            return f"{value:>12,.0f} {unit:<8}"
+    return ''
+
+def report(results: dict, previous: dict = None) -> str:
+    old = {}
+    if previous:
+        for workload in previous["workloads"]:
+            for name, values in workload["stages"].items():
+                old[(workload["name"], name)] = values["seconds"]
+
+    lines = [f"{'workload':<14} {'stage':<13} {'ms':>10} {'throughput':>22} {'peak KB':>10}" + ("   vs old" if previous else '')]
+    for workload in results["workloads"]:
+        for name, values in workload["stages"].items():
+            peak = f"{values['peak_bytes'] / 1024:>10.1f}" if "peak_bytes" in values else f"{'':>10}"
+            line = f"{workload['name']:<14} {name:<13} {values['seconds'] * 1000:>10.3f} {throughput(values):>22} {peak}"
+            before = old.get((workload["name"], name))
+            if before:
+                line += f" {values['seconds'] / before:>8.2f}x"
+            lines.append(line)
+    return '\n'.join(lines)
+
+def main():
+    arguments = argparse.ArgumentParser(description="Times the lexer, parser, optimizer and engines on the .lt programs in " + CORPUS)
+    arguments.add_argument("workloads", nargs="*", help="corpus files or generator names, all of them by default")
+    arguments.add_argument("--engines", default=','.join(ENGINES), help="comma separated engines to run")
+    arguments.add_argument("--repeat", type=int, default=5, help="runs per stage, the best one is kept")
+    arguments.add_argument("--size", type=int, default=2000, help="size of the generated sources")
+    arguments.add_argument("--memo-size", type=int, default=0, help="memo size for pure functions, 0 measures plain calls")
+    arguments.add_argument("--no-memory", action="store_true", help="skip the extra traced run for peak memory")
+    arguments.add_argument("--json", metavar="PATH", help="write the results here")
+    arguments.add_argument("--compare", metavar="PATH", help="results of an earlier run to compare against")
+    arguments = arguments.parse_args()
+
+    src.memo.MEMO_SIZE = arguments.memo_size
+    engines = arguments.engines.split(',')
+
+    workloads = []
+    for file in sorted(os.listdir(CORPUS)):
+        if file.endswith('.lt'):
+            with open(os.path.join(CORPUS, file)) as source:
+                workloads.append((file[:-3], source.read()))
+    for name, generator in GENERATORS.items():
+        workloads.append(("gen:" + name, generator(arguments.size)))
+    if arguments.workloads:
+        workloads = [workload for workload in workloads if workload[0] in arguments.workloads or workload[0].removeprefix("gen:") in arguments.workloads]
+
+    output.set_sink(NullSink())
+    try:
+        results = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "interpreter_version": interpreter_version(),
+            "repeat": arguments.repeat,
+            "size": arguments.size,
+            "memo_size": arguments.memo_size,
+            "workloads": [bench_workload(name, source, engines, arguments.repeat, not arguments.no_memory) for name, source in workloads],
+        }
+    finally:
+        output.set_sink(None)
+
+    previous = None
+    if arguments.compare:
+        with open(arguments.compare) as stream:
+            previous = json.load(stream)
+    print(report(results, previous))
+
+    if arguments.json:
+        with open(arguments.json, "w") as stream:
+            json.dump(results, stream, indent=2)
+
+if __name__ == "__main__":
+    # The generated sources nest deeper than the default recursion limit lets
+    # the parser and optimizer go, so they run on the closure engine's deep stack
+    run_deep(main)
@@ -1,37 +1,254 @@
-import colorama, src.builtin
+from time import perf_counter
+started = perf_counter()
+
+import atexit, importlib, sys, src.builtin, src.memo
 import src.libs.longinput as longinput
-from src.lexer import Tokenizer
+import src.libs.output as output
+from src.libs.lazy import colorama
+from src.libs.startup import StartupProfile
+from src.lexer import Tokenizer, program_map
 from src.parse import Parser
-from src.interpreter import Interpreter
-import sys
-
-sys.setrecursionlimit(50)
+from src.optimizer import Optimizer
 
 file = "test.lt"
 # file = "stdin"
 
+engine = "tree"
+# engine = "vm"
+# engine = "closure"
+
+optimize = True
+# optimize = False
+
+cache = True
+# cache = False
+
+# Results kept per pure function, 0 only memoizes functions marked with memo()
+memo_size = 0
+# memo_size = 1024
+# Print the hits and misses of every memoized function at exit
+memo_report = False
+# memo_report = True
+
+# Keep the namespace of every python() source between calls instead of rerunning it
+python_persist = False
+# python_persist = True
+
+# Run python() in this many worker processes, with a timeout per call in seconds
+python_workers = 0
+# python_workers = 4
+python_timeout = 10.0
+
+# Characters of print() output buffered before writing, 0 writes every line
+output_buffer = 1 << 16
+# output_buffer = 0
+
+# Start from the globals an earlier run saved, instead of running its setup again
+snapshot_load = None
+# snapshot_load = "setup.lts"
+# Save the globals after the run, for snapshot_load
+snapshot_save = None
+# snapshot_save = "setup.lts"
+
+# Time every function and node type on the tree interpreter and report at exit,
+# optionally writing collapsed stacks for flamegraph tools to profile_collapsed
+profile = False
+# profile = True
+profile_collapsed = None
+# profile_collapsed = "profile.folded"
+
+# Sample the tree interpreter's stack every sample_interval seconds and report
+# the hottest source lines at exit, optionally writing collapsed stacks to sample_collapsed
+sample = False
+# sample = True
+sample_interval = 0.01
+sample_collapsed = None
+# sample_collapsed = "sample.folded"
+
+# Print how long importing, lexing, parsing and running took
+startup_profile = False
+# startup_profile = True
+
+# Module and class of each engine, only the one in use is imported
+ENGINES = {
+    "tree": ("src.interpreter", "Interpreter"),
+    "vm": ("src.vm", "VM"),
+    "closure": ("src.closures", "ClosureInterpreter"),
+    "profile": ("src.profiler", "ProfilingInterpreter"),
+}
+
+def get_engine(name: str):
+    module, engine_class = ENGINES[name]
+    return getattr(importlib.import_module(module), engine_class)
+
+def print_profile(interpreter):
+    # Runs at exit, so a program that ends in an error is still reported
+    output.flush()
+    interpreter.finish()
+    print(interpreter.report())
+    if profile_collapsed:
+        with open(profile_collapsed, "w") as stream:
+            stream.write(interpreter.collapsed_stacks() + '\n')
+
+def print_memo_report():
+    output.flush()
+    print(src.memo.memo_report())
+
+def print_samples(sampler):
+    output.flush()
+    sampler.stop()
+    print(sampler.report())
+    if sample_collapsed:
+        with open(sample_collapsed, "w") as stream:
+            stream.write(sampler.collapsed_stacks() + '\n')
+
 def main():
+    src.memo.MEMO_SIZE = memo_size
+    if memo_report:
+        atexit.register(print_memo_report)
+    src.builtin.PYTHON_PERSIST = python_persist
+    src.builtin.PYTHON_WORKERS = python_workers
+    src.builtin.PYTHON_TIMEOUT = python_timeout
+    output.BUFFER_SIZE = output_buffer
+    startup = StartupProfile(started)
+    startup.mark("import")
+    optimizer = Optimizer(enabled=optimize)
+    # hashlib and pickle are only loaded when caching or snapshots are used
+    program_cache = None
+    if cache:
+        from src.cache import ProgramCache
+        program_cache = ProgramCache()
+    if snapshot_load or snapshot_save:
+        from src.snapshot import save_snapshot, load_snapshot, SnapshotError
+
+    # In stdin mode every entry is parsed on its own and run in this one
+    # session, so variables and functions from earlier entries stay defined
+    interpreter = None
+    sampler = None
+
     repeat = True
     while repeat:
+        tree = key = None
         if file != "stdin": 
             repeat = False
-            tokenizer = Tokenizer(longinput.file_input(file))
+            if program_cache:
+                key = program_cache.key(file, optimizer.signature())
+                tree = program_cache.load(file, key)
+                startup.mark("cache")
+            tokenizer = Tokenizer(longinput.file_stream(file))
+            # Lines are mapped as the tokenizer reads them, but a cached tree
+            # is never tokenized, so its file is only mapped for the profilers
+            source_map = tokenizer.source_map
+            if tree is not None and (profile or sample):
+                source_map = program_map(longinput.file_input(file))
         else:
-            tokenizer = Tokenizer(longinput.long_input())
-        parser = Parser(tokenizer)
+            try:
+                source = longinput.long_input()
+            except EOFError:
+                break
+            tokenizer = Tokenizer(source)
+            source_map = tokenizer.source_map
+            startup = StartupProfile(perf_counter())
 
-        tree = parser.parse()
+        # The phase an error is charged to in the startup report
+        phase = "parse"
+        try:
+            if tree is None:
+                if startup_profile:
+                    tokenizer.tokens = startup.timed_tokens(tokenizer.tokens)
+                parser = Parser(tokenizer)
+                tree = parser.parse()
+                startup.mark("parse")
+                tree = optimizer.optimize(tree)
+                startup.mark("optimize")
+                if key:
+                    program_cache.store(file, key, tree)
+                    startup.mark("cache")
 
-        # print(tree)
+            # print(tree)
+            # print(optimizer.report())
+            # print(program_cache.report())
 
-        print('')
-        interpreter = Interpreter(tree)
-        interpreter.interpret('stdin')
+            print('')
+            if interpreter is None:
+                interpreter = get_engine("profile" if profile else "tree" if sample else engine)(tree)
+                if profile:
+                    atexit.register(print_profile, interpreter)
+                if sample:
+                    from src.sampler import Sampler
+                    sampler = Sampler(interpreter, interval=sample_interval)
+                    atexit.register(print_samples, sampler)
+                if snapshot_load:
+                    try:
+                        if not load_snapshot(interpreter, snapshot_load):
+                            print(f"{colorama.Fore.YELLOW}Snapshot {snapshot_load} is from another interpreter version, not loaded{colorama.Style.RESET_ALL}")
+                    except SnapshotError as ex:
+                        print(f"{colorama.Fore.YELLOW}Snapshot {snapshot_load} could not be read: {ex}, not loaded{colorama.Style.RESET_ALL}")
+            phase = "run"
+            if profile:
+                interpreter.set_source(source_map)
+            if sampler:
+                sampler.set_source(source_map)
+                sampler.start(tree)
+            try:
+                interpreter.feed(tree, file)
+            finally:
+                if sampler:
+                    sampler.stop()
+            output.flush()
+            startup.mark("run")
+            if snapshot_save:
+                try:
+                    save_snapshot(interpreter, snapshot_save)
+                except SnapshotError as ex:
+                    print(f"{colorama.Fore.YELLOW}Snapshot {snapshot_save} could not be saved: {ex}{colorama.Style.RESET_ALL}")
+        except SystemExit:
+            # The timings are still reported for a run that ends in an error
+            startup.mark(phase)
+            if startup_profile:
+                print(startup.report())
+            # Errors end a program, but only the current entry of a session
+            if not repeat:
+                raise
+            continue
 
         print(f"\n{colorama.Fore.YELLOW}GLOBAL MEMORY:")
-        for k, v in sorted(interpreter.global_scope.vars.items()):
+        for k, v in sorted(interpreter.global_scope.vars.flatten().items()):
             print(f"{colorama.Fore.CYAN}{k}{colorama.Fore.WHITE} = {v}")
         print()
 
+        if startup_profile:
+            print(startup.report())
+
+def parse_arguments():
+    # argparse is only imported when there are flags to read
+    global memo_size, memo_report, snapshot_load, snapshot_save, startup_profile, profile, profile_collapsed, sample, sample_interval, sample_collapsed
+    import argparse
+
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("--memo-size", metavar="RESULTS", type=int, default=memo_size)
+    arguments.add_argument("--memo-report", action="store_true", default=memo_report)
+    arguments.add_argument("--load-snapshot", metavar="PATH", default=snapshot_load)
+    arguments.add_argument("--save-snapshot", metavar="PATH", default=snapshot_save)
+    arguments.add_argument("--startup-profile", action="store_true", default=startup_profile)
+    arguments.add_argument("--profile", action="store_true", default=profile)
+    arguments.add_argument("--profile-collapsed", metavar="PATH", default=profile_collapsed)
+    arguments.add_argument("--sample", action="store_true", default=sample)
+    arguments.add_argument("--sample-interval", metavar="SECONDS", type=float, default=sample_interval)
+    arguments.add_argument("--sample-collapsed", metavar="PATH", default=sample_collapsed)
+    arguments = arguments.parse_args()
+    memo_size = arguments.memo_size
+    memo_report = arguments.memo_report
+    snapshot_load = arguments.load_snapshot
+    snapshot_save = arguments.save_snapshot
+    startup_profile = arguments.startup_profile
+    profile = arguments.profile or arguments.profile_collapsed is not None
+    profile_collapsed = arguments.profile_collapsed
+    sample = arguments.sample or arguments.sample_collapsed is not None
+    sample_interval = arguments.sample_interval
+    sample_collapsed = arguments.sample_collapsed
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        parse_arguments()
     main()
\ No newline at end of file
@@ -0,0 +1,153 @@
+from src.interpreter import register_value
+from src.parsetokens import Value, Num, OperationError, number
+from array import array
+from itertools import repeat
+from math import isinf
+import importlib, operator
+
+# NumPy is only a faster backend, everything works on the stdlib array('d') alone.
+# It is imported with the first Array, so programs without arrays never load it.
+USE_NUMPY = True
+numpy = None
+
+def load_numpy() -> bool:
+    global numpy, USE_NUMPY
+    if USE_NUMPY and numpy is None:
+        try:
+            numpy = importlib.import_module("numpy")
+        except ImportError:
+            USE_NUMPY = False
+    return USE_NUMPY
+
+OPERATORS = {
+    "PLUS": operator.add,
+    "MINUS": operator.sub,
+    "MUL": operator.mul,
+    "DIV": operator.truediv,
+    "DIVDIV": operator.floordiv,
+    "MOD": operator.mod,
+    "EXP": operator.pow,
+    "EQUALSE": operator.eq,
+    "BANGE": operator.ne,
+    "LESSER": operator.lt,
+    "LESSERE": operator.le,
+    "GREATER": operator.gt,
+    "GREATERE": operator.ge,
+}
+
+DIVISIONS = (operator.truediv, operator.floordiv, operator.mod)
+
+def make_buffer(values):
+    if load_numpy():
+        return numpy.fromiter(values, dtype=numpy.float64)
+    return array('d', values)
+
+def reduce(name: str, buffer) -> float:
+    # sum, min, max or mean of a whole buffer
+    if load_numpy():
+        return float(getattr(numpy, name)(buffer))
+    elif name == "mean":
+        return sum(buffer) / len(buffer)
+    return float({"sum": sum, "min": min, "max": max}[name](buffer))
+
+def broadcast(function, x, y):
+    # x and y are buffers or floats, at least one a buffer. A float is paired
+    # with every element, two buffers are paired element by element.
+    if type(x) != float and type(y) != float and len(x) != len(y):
+        raise OperationError(f"Array sizes differ ({len(x)} and {len(y)})")
+
+    # Both backends fail on a division by zero, a result too large for a float
+    # and one that is not a real number, where NumPy would give inf or nan
+    try:
+        if load_numpy():
+            with numpy.errstate(divide='raise', over='raise', invalid='raise'):
+                result = function(x, y)
+            if result.dtype != numpy.float64:
+                result = result.astype(numpy.float64)
+            return result
+
+        if type(x) == float:
+            x = repeat(x)
+        elif type(y) == float:
+            y = repeat(y)
+        return array('d', map(checked(function), x, y))
+    except ArithmeticError as ex:
+        # ZeroDivisionError from the stdlib, FloatingPointError from NumPy
+        if isinstance(ex, ZeroDivisionError) or function in DIVISIONS or "divide by zero" in str(ex):
+            raise OperationError("Array division by zero")
+        raise OperationError("Array arithmetic out of range")
+    except (TypeError, ValueError):
+        # array('d') refusing a complex result, such as array(-1) ^ 0.5
+        raise OperationError("Array arithmetic out of range")
+
+def checked(function):
+    # Python floats overflow to inf on their own except in pow, so an
+    # infinite result from finite elements is made an OverflowError as well
+    def element(a, b):
+        result = function(a, b)
+        if isinf(result) and not isinf(a) and not isinf(b):
+            raise OverflowError
+        return result
+    return element
+
+##########################################
+##                                      ##
+##  Array                               ##
+##                                      ##
+##########################################
+
+class Array(Value):
+    # A run of numbers in one contiguous buffer. Operators work on the whole
+    # buffer at once, and a Num on either side is applied to every element.
+    __slots__ = ('value', 'oindex')
+
+    def __init__(self, value, oindex: int = 0) -> None:
+        self.value = value
+        self.oindex = oindex
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def operand(self, other, op: str, reflected: bool = False):
+        if type(other) == Num:
+            return other.value
+        elif type(other) == Array:
+            return other.value
+        if reflected:
+            raise OperationError(f"Invalid operation {type(other).__name__} {op} Array")
+        raise OperationError(f"Invalid operation Array {op} {type(other).__name__}")
+
+    def string(self) -> str:
+        return '[' + ', '.join(number(float(value)).string() for value in self.value) + ']'
+
+    def bool(self) -> bool:
+        return len(self.value) != 0
+
+    def iterate(self):
+        return map(number, map(float, self.value))
+
+    def op_POS(self):
+        return self
+
+    def op_NEG(self):
+        return Array(broadcast(operator.sub, 0.0, self.value))
+
+    def __repr__(self) -> str:
+        return f"Array({self.string()})"
+
+def binary(op: str, reflected: bool):
+    function = OPERATORS[op]
+    if reflected:
+        def operation(self, other):
+            return Array(broadcast(function, self.operand(other, op, True), self.value))
+    else:
+        def operation(self, other):
+            return Array(broadcast(function, self.value, self.operand(other, op)))
+    return operation
+
+# op_ for Array on the left, rop_ for Array on the right of a Num
+for op in OPERATORS:
+    setattr(Array, "op_" + op, binary(op, False))
+    setattr(Array, "rop_" + op, binary(op, True))
+
+register_value(Array)
@@ -1,7 +1,55 @@
 from src.parsetokens import *
 import src.parsetokens, importlib
+import src.libs.output as output
+from src.memo import make_memo
+from src.arrays import Array, make_buffer, reduce
 from types import FunctionType, NoneType
 
+# Code objects for python() by source text, oldest dropped past the size
+PYTHON_CACHE_SIZE = 256
+python_code = {}
+
+# When on, python() runs each source once and keeps its namespace; later calls
+# with the same source only call the main it already defined.
+PYTHON_PERSIST = False
+python_mains = {}
+
+# Worker processes for python(), 0 runs it in this process. python_start()
+# always goes through the pool and sizes it to the CPU count when this is 0.
+PYTHON_WORKERS = 0
+# Seconds a pooled python() call may run before its worker is killed
+PYTHON_TIMEOUT = 10.0
+python_pool = None
+
+def get_python_pool():
+    global python_pool
+    if python_pool is None:
+        # multiprocessing is only imported once python() needs a worker
+        from src.libs.pypool import PythonPool
+        python_pool = PythonPool(PYTHON_WORKERS, PYTHON_TIMEOUT, PYTHON_PERSIST)
+    return python_pool
+
+def python_compile(source: str):
+    code = python_code.get(source)
+    if code is None:
+        if len(python_code) >= PYTHON_CACHE_SIZE:
+            del python_code[next(iter(python_code))]
+        code = python_code[source] = compile(source, '<python>', 'exec')
+    return code
+
+def python_main(source: str):
+    if PYTHON_PERSIST:
+        main = python_mains.get(source)
+        if main is not None:
+            return main
+
+    py_globals = {}
+    exec(python_compile(source), py_globals)
+    main = py_globals['main']
+    if PYTHON_PERSIST:
+        python_mains[source] = main
+    return main
+
 def get_globals():
 
     def expect_amount(length, parameters):
@@ -16,11 +64,11 @@ def get_globals():
         if type(object) == Exception:
             return Error(py_eval(' '.join(object.args)))
         elif type(object) == str:
-            return String(Token("STRING", object, 0))
+            return String(object)
         elif type(object) in (int, float):
-            return Num(Token("NUMBER", float(object), 0))
+            return number(float(object))
         elif type(object) == NoneType:
-            return Nil(0)
+            return NIL
         elif type(object) == FunctionType:
             return Function(object)
         return py_eval(Exception(f"Cannot evaluate type: <{type(object).__name__}>"))
@@ -29,31 +77,156 @@ def get_globals():
         if not expect_amount(0, parameters):
             return lack_parameters()
 
-        value = ''
-        for x in parameters:
-            value += " " + x.string()
-
-        value = value[1:]
+        output.write(' '.join([x.string() for x in parameters]) + '\n')
 
-        print(value)
+        return py_eval()
 
+    def flush(*parameters):
+        output.flush()
         return py_eval()
     
+    def python_timeout(parameters):
+        # None for the pool's own timeout, an Error if it is not a number of seconds
+        if not expect_amount(2, parameters):
+            return None
+        if type(parameters[1]) != Num or not 0 < parameters[1].value < float('inf'):
+            return py_eval(Exception("python() timeout must be a number of seconds"))
+        return parameters[1].value
+
     def python(*parameters):
         if not expect_amount(1, parameters):
             return lack_parameters()
+        timeout = python_timeout(parameters)
+        if type(timeout) == Error:
+            return timeout
+        # The snippet may print on its own
+        output.flush()
+        if PYTHON_WORKERS:
+            pool = get_python_pool()
+            return py_eval(pool.wait(pool.start(parameters[0].value, timeout)))
+
         value = None
         try:
-            py_globals = {}
-            exec(parameters[0].token.value, py_globals)
-            value = py_globals['main']()
+            value = python_main(parameters[0].value)()
         except Exception as ex:
             value = Exception(' '.join(ex.args))
         return py_eval(value)
 
+    def python_start(*parameters):
+        if not expect_amount(1, parameters):
+            return lack_parameters()
+        timeout = python_timeout(parameters)
+        if type(timeout) == Error:
+            return timeout
+        output.flush()
+        return py_eval(get_python_pool().start(parameters[0].value, timeout))
+
+    def python_wait(*parameters):
+        if not expect_amount(1, parameters):
+            return lack_parameters()
+        job = parameters[0]
+        if type(job) != Num or not float(job.value).is_integer():
+            return py_eval(Exception(f"No python() job {job.string()}"))
+        return py_eval(get_python_pool().wait(int(job.value)))
+
+    def memo(*parameters):
+        if not expect_amount(1, parameters):
+            return lack_parameters()
+        func = parameters[0]
+        if not isinstance(func, Function) or type(func.scope) == FunctionType:
+            return py_eval(Exception("Only user functions can be memoized"))
+
+        size = None
+        if expect_amount(2, parameters):
+            if type(parameters[1]) != Num or not 0 <= parameters[1].value < float('inf'):
+                return py_eval(Exception("memo size must be a number of at least 0"))
+            size = int(parameters[1].value)
+        func.memo = make_memo(func, size)
+        return func
+
+    def pure(function):
+        # Lets src.memo treat .lt functions calling this builtin as pure
+        function.pure = True
+        return function
+
+    def numbers(parameters):
+        for x in parameters:
+            if type(x) == Array:
+                yield from x.value
+            elif type(x) == Num:
+                yield x.value
+            else:
+                raise TypeError(f"Expected numbers, got {type(x).__name__}")
+
+    @pure
+    def array_func(*parameters):
+        try:
+            return Array(make_buffer(numbers(parameters)))
+        except TypeError as ex:
+            return py_eval(Exception(str(ex)))
+
+    @pure
+    def arange(*parameters):
+        if not expect_amount(2, parameters):
+            return lack_parameters()
+        if not all(type(x) == Num for x in parameters[:3]):
+            return py_eval(Exception("arange expects numbers"))
+        start, stop = parameters[0].value, parameters[1].value
+        step = parameters[2].value if expect_amount(3, parameters) else 1.0
+        if step == 0:
+            return py_eval(Exception("arange step cannot be 0"))
+        count = max(0, -int((start - stop) // step))
+        return Array(make_buffer(start + index * step for index in range(count)))
+
+    @pure
+    def size(*parameters):
+        if not expect_amount(1, parameters):
+            return lack_parameters()
+        if type(parameters[0]) != Array:
+            return py_eval(Exception("size expects an Array"))
+        return number(float(len(parameters[0].value)))
+
+    @pure
+    def at(*parameters):
+        if not expect_amount(2, parameters):
+            return lack_parameters()
+        if type(parameters[0]) != Array:
+            return py_eval(Exception("at expects an Array"))
+        if type(parameters[1]) != Num:
+            return py_eval(Exception("at expects a number index"))
+        buffer, index = parameters[0].value, parameters[1].value
+        if not 0 <= index < len(buffer):
+            return py_eval(Exception("Array index out of range"))
+        return number(float(buffer[int(index)]))
+
+    def reduction(name):
+        @pure
+        def reduction_func(*parameters):
+            if not expect_amount(1, parameters):
+                return lack_parameters()
+            value = parameters[0]
+            if type(value) != Array:
+                return py_eval(Exception(f"{name} expects an Array"))
+            if len(value) == 0:
+                return py_eval(Exception(f"{name} of an empty Array"))
+            return number(reduce(name, value.value))
+        return reduction_func
+
     return {
+    "array": Function(array_func),
+    "arange": Function(arange),
+    "size": Function(size),
+    "at": Function(at),
+    "sum": Function(reduction("sum")),
+    "min": Function(reduction("min")),
+    "max": Function(reduction("max")),
+    "mean": Function(reduction("mean")),
     "print": Function(print_func),
+    "flush": Function(flush),
     "python": Function(python),
+    "python_start": Function(python_start),
+    "python_wait": Function(python_wait),
+    "memo": Function(memo),
     }
 
-src.parsetokens.default_vars = get_globals()
\ No newline at end of file
+src.parsetokens.default_vars.update(get_globals())
\ No newline at end of file
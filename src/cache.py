@@ -0,0 +1,94 @@
+import gc, hashlib, os, pickle, sys
+import src.libs.longinput as longinput
+
+##########################################
+##                                      ##
+##  Program Cache                       ##
+##                                      ##
+##########################################
+
+# Trees are pickled, so any change to the modules that build them has to make
+# old .ltc files stale. Their source is hashed into the version instead of a
+# number that someone would have to remember to bump.
+VERSION_MODULES = ("lexer.py", "parse.py", "parsetokens.py", "optimizer.py")
+
+def interpreter_version() -> str:
+    version = hashlib.sha256(sys.version.encode())
+    directory = os.path.dirname(__file__)
+    for module in VERSION_MODULES:
+        with open(os.path.join(directory, module), "rb") as source:
+            version.update(source.read())
+    return version.hexdigest()
+
+class ProgramCache:
+    # Stores parsed programs as .ltc files, next to the source or in one cache
+    # directory. An entry is only used when both the hash of the source and
+    # the interpreter version it was written with still match. The key is
+    # taken before parsing, so a source edited mid-run only leaves behind an
+    # entry that misses next time.
+    def __init__(self, directory: str = None) -> None:
+        self.directory = directory
+        self.version = interpreter_version()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, file: str) -> str:
+        if self.directory is None:
+            return longinput.file_path(file) + 'c'
+        return os.path.join(self.directory, file.replace(os.sep, '_') + 'c')
+
+    def key(self, file: str, variant: str = '') -> str:
+        key = hashlib.sha256(self.version.encode())
+        key.update(variant.encode())
+        for chunk in longinput.file_stream(file):
+            key.update(chunk.encode())
+        return key.hexdigest()
+
+    def load(self, file: str, key: str):
+        # Unpickling allocates every node at once, which otherwise sets off
+        # the cyclic collector over and over for nothing it could free
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(self.path(file), "rb") as stream:
+                cached_key, tree = pickle.load(stream)
+        except Exception:
+            cached_key = None
+        finally:
+            if enabled:
+                gc.enable()
+
+        if cached_key != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return tree
+
+    def store(self, file: str, key: str, tree) -> bool:
+        path = self.path(file)
+        try:
+            data = pickle.dumps((key, tree), pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            # Deeply nested programs are still run, just never cached
+            return False
+
+        # Written to a temporary file first so a reader never sees half an
+        # entry. Caching is optional, so a directory that can't be written
+        # to only means the program is parsed again next time.
+        temporary = path + '.tmp'
+        try:
+            if self.directory is not None:
+                os.makedirs(self.directory, exist_ok=True)
+            with open(temporary, "wb") as stream:
+                stream.write(data)
+            os.replace(temporary, path)
+        except OSError:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def report(self) -> str:
+        return f"Program cache: {self.hits} hits, {self.misses} misses"
@@ -0,0 +1,346 @@
+import sys, threading
+from src.interpreter import NodeVisitor, Interpreter, register_value
+import src.libs.output as output
+from src.parse import underline_char, colorama
+from src.parsetokens import Function, Environment, Frame, Error, NIL, Return, default_vars
+from src.memo import get_memo
+
+##########################################
+##                                      ##
+##  Closure Compiler                    ##
+##                                      ##
+##########################################
+
+class CompiledFunction(Function):
+    def __init__(self, function: Function, names: list, body, env: Environment) -> None:
+        self.parameters = function.parameters
+        self.scope = function.scope
+        self.names = names
+        self.body = body
+        self.env = env
+
+register_value(CompiledFunction)
+
+class TailCall:
+    # What a call in tail position returns instead of running the callee. It
+    # passes back through the scopes of the caller to the nearest ordinary
+    # call, which runs it there so the Python stack stays flat.
+    __slots__ = ('body', 'env')
+
+    def __init__(self, body, env: Environment) -> None:
+        self.body = body
+        self.env = env
+
+class LoopBreak(Exception):
+    pass
+
+class LoopContinue(Exception):
+    pass
+
+class ClosureCompiler(NodeVisitor):
+    # Turns every node into a Python closure taking the current variable dict,
+    # so running a program is plain nested calls with no visit dispatch.
+    def __init__(self, interpreter: Interpreter) -> None:
+        self.interpreter = interpreter
+
+    def error(self, reason: str):
+        output.flush()
+        print(f"\n{colorama.Fore.RED}{underline_char}Compiling Error{colorama.Style.RESET_ALL}\n{reason}\n")
+        sys.exit()
+
+    def statements(self, statements: list):
+        # Mirrors Interpreter.visit_Scope: a Return ends the scope with its value.
+        body = []
+        for statement in statements:
+            if type(statement) == Return:
+                return body, self.visit(statement.token)
+            body.append(self.visit(statement))
+
+        def result(env):
+            return NIL
+        return body, result
+
+    def function(self, node):
+        names = [identifier.value for identifier in node.parameters.identifiers]
+        body, result = self.statements(node.scope.statements)
+
+        def run(env):
+            for statement in body:
+                statement(env)
+            return result(env)
+
+        def make_function(env):
+            return CompiledFunction(node, names, run, env)
+        return make_function
+
+    def visit_Call(self, node):
+        arguments = [self.visit(parameter) for parameter in node.parameters.values]
+        left = self.visit(node.left)
+        error = self.interpreter.error
+
+        tail = node.tail
+
+        def call(env):
+            params = [argument(env) for argument in arguments]
+            func = left(env)
+            if type(func) == CompiledFunction:
+                names = func.names
+                if len(params) < len(names):
+                    error("Not enough parameters entered")
+                memo = func.memo
+                if memo is None:
+                    memo = get_memo(func)
+                key = None
+                if memo:
+                    key = memo.key(params)
+                    if key is not None:
+                        value = memo.get(key)
+                        if value is not None:
+                            return value
+
+                env = Environment(func.env, dict(zip(names, params)))
+                if tail:
+                    return TailCall(func.body, env)
+
+                value = func.body(env)
+                while type(value) == TailCall:
+                    value = value.body(value.env)
+                if key is not None:
+                    memo.put(key, value)
+                return value
+            elif isinstance(func, Function):
+                value = func.call(params)
+                if type(value) == Error:
+                    error(value.token.value)
+                return value
+            error(f"Cannot call {type(func).__name__}")
+        return call
+
+    def visit_BinOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        op = node.op.type
+        operate = self.interpreter.operate
+
+        def binop(env):
+            return operate(op, left(env), right(env))
+        return binop
+
+    def visit_UnaryOp(self, node):
+        expr = self.visit(node.expr)
+        op = node.op.type
+        operate = self.interpreter.operate
+
+        def unaryop(env):
+            return operate(op, expr(env))
+        return unaryop
+
+    def visit_Scope(self, node):
+        body, result = self.statements(node.statements)
+
+        if node.shares:
+            def scope(env):
+                for statement in body:
+                    statement(env)
+                return result(env)
+        else:
+            def scope(env):
+                env = Environment(env)
+                for statement in body:
+                    statement(env)
+                return result(env)
+        return scope
+
+    def visit_If(self, node):
+        condition = self.visit(node.condition)
+        result = self.visit(node.result)
+
+        def if_statement(env):
+            if condition(env).bool():
+                return result(env)
+            return NIL
+        return if_statement
+
+    def visit_For(self, node):
+        iterable = self.visit(node.iterable)
+        body = self.visit(node.body)
+        var_name = node.var.value
+        error = self.interpreter.error
+
+        # break and continue unwind the Python calls of the body as exceptions
+        def for_loop(env):
+            value = iterable(env)
+            iterator = value.iterate()
+            if iterator is None:
+                error(f"Cannot loop over {type(value).__name__}")
+            for value in iterator:
+                env[var_name] = value
+                try:
+                    body(env)
+                except LoopContinue:
+                    pass
+                except LoopBreak:
+                    break
+            return NIL
+        return for_loop
+
+    def visit_While(self, node):
+        condition = self.visit(node.condition)
+        body = self.visit(node.body)
+
+        def while_loop(env):
+            while condition(env).bool():
+                try:
+                    body(env)
+                except LoopContinue:
+                    pass
+                except LoopBreak:
+                    break
+            return NIL
+        return while_loop
+
+    def visit_Break(self, _):
+        def break_loop(env):
+            raise LoopBreak
+        return break_loop
+
+    def visit_Continue(self, _):
+        def continue_loop(env):
+            raise LoopContinue
+        return continue_loop
+
+    def visit_Return(self, node):
+        return self.visit(node.token)
+
+    def visit_Reassign(self, node):
+        var_name = node.left.value
+        right = self.visit(node.right)
+        op = node.token.type
+        operate = self.interpreter.operate
+
+        def reassign(env):
+            value = right(env)
+            env[var_name] = operate(op, env.lookup(var_name), value)
+            return value
+        return reassign
+
+    def visit_Assign(self, node):
+        var_name = node.left.value
+        if type(node.right) == Function:
+            right = self.function(node.right)
+        else:
+            right = self.visit(node.right)
+
+        if node.public:
+            interpreter = self.interpreter
+
+            def assign(env):
+                value = right(env)
+                env[var_name] = value
+                interpreter.global_scope.vars[var_name] = value
+                return value
+        else:
+            def assign(env):
+                value = right(env)
+                env[var_name] = value
+                return value
+        return assign
+
+    def visit_Nil(self, _):
+        def nil(env):
+            return NIL
+        return nil
+
+    def visit_Var(self, node):
+        var_name = node.value
+        error = self.interpreter.error
+
+        def var(env):
+            try:
+                return env[var_name]
+            except KeyError:
+                error(f"Invalid Variable: {var_name}")
+        return var
+
+    def visit_Function(self, node):
+        return self.function(node)
+
+    def visit_String(self, node):
+        def constant(env):
+            return node
+        return constant
+
+    visit_Bool = visit_Num = visit_String
+
+##########################################
+##                                      ##
+##  Closure Interpreter                 ##
+##                                      ##
+##########################################
+
+# Calls that are not tail calls nest Python calls, about six frames for each
+# .lt call. Programs run on a thread whose stack holds RECURSION_LIMIT frames
+# at well over 1KB each, which ends deep recursion at roughly 65000 calls
+# instead of MAX_DEPTH, but as an error rather than a crash.
+STACK_SIZE = 512 * 1024 * 1024
+RECURSION_LIMIT = 400000
+
+def run_deep(function, *args):
+    outcome = []
+    def target():
+        try:
+            outcome.append((True, function(*args)))
+        except BaseException as ex:
+            outcome.append((False, ex))
+
+    limit = sys.getrecursionlimit()
+    size = threading.stack_size(STACK_SIZE)
+    try:
+        # The limit is for every thread, but the caller only waits meanwhile
+        sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+    finally:
+        threading.stack_size(size)
+        sys.setrecursionlimit(limit)
+
+    finished, value = outcome[0]
+    if not finished:
+        raise value
+    return value
+
+class ClosureInterpreter(Interpreter):
+    def __init__(self, tree) -> None:
+        self.tree = tree
+        self.program = None
+        self.global_scope = None
+
+    def make_function(self, node, env: Environment):
+        return ClosureCompiler(self).function(node)(env)
+
+    def feed(self, tree, file: str | list | tuple = ''):
+        self.program = None
+        return super().feed(tree, file)
+
+    def interpret(self, file: str | list | tuple = '', variables: Environment = None):
+        tree = self.tree
+        if tree is None:
+            return ''
+
+        # Compiled once, then every run only pays for the closure calls.
+        if self.program is None:
+            body, result = ClosureCompiler(self).statements(tree.statements)
+
+            def program(env):
+                for statement in body:
+                    statement(env)
+                return result(env)
+            self.program = program
+
+        if variables is None: variables = Environment(default_vars)
+        self.global_scope = Frame(tree, variables)
+        try:
+            return run_deep(self.program, self.global_scope.vars)
+        except RecursionError:
+            self.error(f"Maximum call depth exceeded (closure engine, {RECURSION_LIMIT} Python frames)")
@@ -0,0 +1,242 @@
+import sys
+from src.interpreter import NodeVisitor
+import src.libs.output as output
+from src.parse import underline_char, colorama
+from src.parsetokens import Function, Return
+
+##########################################
+##                                      ##
+##  Opcodes                             ##
+##                                      ##
+##########################################
+
+LOAD_CONST = 0
+LOAD_NIL = 1
+LOAD_VAR = 2
+STORE_VAR = 3
+STORE_PUB = 4
+REASSIGN = 5
+BINARY_OP = 6
+UNARY_OP = 7
+CALL = 8
+MAKE_FUNCTION = 9
+JUMP = 10
+JUMP_IF_FALSE = 11
+POP = 12
+ENTER_SCOPE = 13
+EXIT_SCOPE = 14
+RETURN = 15
+HALT = 16
+TAIL_CALL = 17
+GET_ITER = 18
+FOR_ITER = 19
+
+OPNAMES = {
+    LOAD_CONST: "LOAD_CONST",
+    LOAD_NIL: "LOAD_NIL",
+    LOAD_VAR: "LOAD_VAR",
+    STORE_VAR: "STORE_VAR",
+    STORE_PUB: "STORE_PUB",
+    REASSIGN: "REASSIGN",
+    BINARY_OP: "BINARY_OP",
+    UNARY_OP: "UNARY_OP",
+    CALL: "CALL",
+    MAKE_FUNCTION: "MAKE_FUNCTION",
+    JUMP: "JUMP",
+    JUMP_IF_FALSE: "JUMP_IF_FALSE",
+    POP: "POP",
+    ENTER_SCOPE: "ENTER_SCOPE",
+    EXIT_SCOPE: "EXIT_SCOPE",
+    RETURN: "RETURN",
+    HALT: "HALT",
+    TAIL_CALL: "TAIL_CALL",
+    GET_ITER: "GET_ITER",
+    FOR_ITER: "FOR_ITER",
+}
+
+class Code:
+    def __init__(self, name: str = '') -> None:
+        self.name = name
+        self.instructions = []
+
+    def emit(self, op: int, arg = None) -> int:
+        self.instructions.append((op, arg))
+        return len(self.instructions) - 1
+
+    def patch(self, index: int, arg) -> None:
+        self.instructions[index] = (self.instructions[index][0], arg)
+
+    def here(self) -> int:
+        return len(self.instructions)
+
+    def __repr__(self) -> str:
+        lines = [f"Code({self.name})"]
+        for index, (op, arg) in enumerate(self.instructions):
+            if op == MAKE_FUNCTION:
+                arg = arg[1].name
+            lines.append(f"{index:>5}  {OPNAMES[op]:<14} {'' if arg is None else arg}")
+        return '\n'.join(lines)
+
+##########################################
+##                                      ##
+##  Compiler                            ##
+##                                      ##
+##########################################
+
+class Compiler(NodeVisitor):
+    def __init__(self, tree) -> None:
+        self.tree = tree
+
+    def error(self, reason: str):
+        output.flush()
+        print(f"\n{colorama.Fore.RED}{underline_char}Compiling Error{colorama.Style.RESET_ALL}\n{reason}\n")
+        sys.exit()
+
+    def emit(self, op: int, arg = None) -> int:
+        return self.code.emit(op, arg)
+
+    def statements(self, statements: list):
+        # Mirrors Interpreter.visit_Scope: a Return ends the scope with its value,
+        # anything after it is unreachable and never compiled.
+        for statement in statements:
+            if type(statement) == Return:
+                self.visit(statement.token)
+                return
+            self.visit(statement)
+            self.emit(POP)
+        self.emit(LOAD_NIL)
+
+    def function(self, node, name: str = '<anonymous>'):
+        code, self.code = self.code, Code(name)
+        depth, self.depth = self.depth, 0
+        self.statements(node.scope.statements)
+        self.emit(RETURN)
+        self.depth = depth
+        code, self.code = self.code, code
+        self.emit(MAKE_FUNCTION, (node, code))
+
+    def visit_Call(self, node):
+        for parameter in node.parameters.values:
+            self.visit(parameter)
+        self.visit(node.left)
+        self.emit(TAIL_CALL if node.tail else CALL, len(node.parameters.values))
+
+    def visit_BinOp(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+        self.emit(BINARY_OP, node.op.type)
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.expr)
+        self.emit(UNARY_OP, node.op.type)
+
+    def visit_Scope(self, node):
+        self.emit(ENTER_SCOPE, node.shares)
+        self.depth += 1
+        self.statements(node.statements)
+        self.depth -= 1
+        self.emit(EXIT_SCOPE)
+
+    def loop(self, node, start: int):
+        # Jumps out of the body leave every scope entered since the loop began
+        self.loops.append((start, self.depth, []))
+        self.visit(node.body)
+        self.emit(POP)
+        self.emit(JUMP, start)
+        return self.loops.pop()[2]
+
+    def visit_For(self, node):
+        # The iterator stays on the stack under the body until the loop ends
+        self.visit(node.iterable)
+        self.emit(GET_ITER)
+        start = self.code.here()
+        exhausted = self.emit(FOR_ITER)
+        breaks = self.loop(node, start)
+        for index in breaks:
+            self.code.patch(index, self.code.here())
+        self.emit(POP)
+        self.code.patch(exhausted, (self.code.here(), node.var.value))
+        self.emit(LOAD_NIL)
+
+    def visit_While(self, node):
+        start = self.code.here()
+        self.visit(node.condition)
+        exhausted = self.emit(JUMP_IF_FALSE)
+        breaks = self.loop(node, start)
+        for index in breaks:
+            self.code.patch(index, self.code.here())
+        self.code.patch(exhausted, self.code.here())
+        self.emit(LOAD_NIL)
+
+    def leave_loop(self):
+        start, depth, breaks = self.loops[-1]
+        for _ in range(self.depth - depth):
+            self.emit(EXIT_SCOPE)
+        return start, breaks
+
+    def visit_Break(self, _):
+        start, breaks = self.leave_loop()
+        breaks.append(self.emit(JUMP))
+
+    def visit_Continue(self, _):
+        start, breaks = self.leave_loop()
+        self.emit(JUMP, start)
+
+    def visit_If(self, node):
+        self.visit(node.condition)
+        skip = self.emit(JUMP_IF_FALSE)
+        self.visit(node.result)
+        end = self.emit(JUMP)
+        self.code.patch(skip, self.code.here())
+        self.emit(LOAD_NIL)
+        self.code.patch(end, self.code.here())
+
+    def visit_Return(self, node):
+        self.visit(node.token)
+
+    def visit_Reassign(self, node):
+        self.visit(node.right)
+        self.emit(REASSIGN, (node.left.value, node.token.type))
+
+    def visit_Assign(self, node):
+        var_name = node.left.value
+        if type(node.right) == Function:
+            self.function(node.right, var_name)
+        else:
+            self.visit(node.right)
+        self.emit(STORE_PUB if node.public else STORE_VAR, var_name)
+
+    def visit_Nil(self, _):
+        self.emit(LOAD_NIL)
+
+    def visit_Var(self, node):
+        self.emit(LOAD_VAR, node.value)
+
+    def visit_Function(self, node):
+        self.function(node)
+
+    def visit_String(self, node):
+        self.emit(LOAD_CONST, node)
+
+    def visit_Bool(self, node):
+        self.emit(LOAD_CONST, node)
+
+    def visit_Num(self, node):
+        self.emit(LOAD_CONST, node)
+
+    def compile_function(self, node) -> Code:
+        # The Code of one function on its own, outside of any program
+        self.code = Code('<program>')
+        self.depth = 0
+        self.loops = []
+        self.function(node)
+        return self.code.instructions[-1][1][1]
+
+    def compile(self) -> Code:
+        self.code = Code('<program>')
+        self.depth = 0
+        self.loops = []
+        if self.tree is not None:
+            self.statements(self.tree.statements)
+        self.emit(HALT)
+        return self.code
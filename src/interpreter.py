@@ -1,20 +1,70 @@
-from src.parse import Nil, underline_char, colorama, Bool, Token
-from src.parsetokens import Value
+import sys
+from src.parse import Nil, NIL, underline_char, colorama, Bool, Token
+import src.libs.output as output
+from src.parsetokens import NodeVisitor, OperationError, Value, Num, String, Rope, Function, Tuple, Return, Frame, Environment, Error, BREAK, CONTINUE, default_vars
+from src.memo import get_memo
+from types import GeneratorType
 
 ##########################################
 ##                                      ##
-##  AST VISITORS                        ##
+##  Operations                          ##
 ##                                      ##
 ##########################################
 
-class NodeVisitor(object):
-    def visit(self, node):
-        method_name = "visit_" + type(node).__name__
-        visitor = getattr(self, method_name, self.generic_visit)
-        return visitor(node)
-    
-    def generic_visit(self, node):
-        self.error(f'No visit_{type(node).__name__} method')
+BINARY_OPS = ("PLUS", "MINUS", "MUL", "DIV", "DIVDIV", "MOD", "EXP", "EQUALS", "EQUALSE", "BANGE", "LESSER", "LESSERE", "GREATER", "GREATERE", "OR", "AND", "DOTDOT")
+
+# Used when the left value has no op_ method of its own
+BINARY_FALLBACKS = {
+    "EQUALS": lambda x, y: Bool(y.value),
+    "EQUALSE": lambda x, y: x == y,
+    "BANGE": lambda x, y: x != y,
+    "LESSER": lambda x, y: x < y,
+    "LESSERE": lambda x, y: x <= y,
+    "GREATER": lambda x, y: x > y,
+    "GREATERE": lambda x, y: x >= y,
+    "OR": lambda x, y: x or y,
+    "AND": lambda x, y: x and y,
+}
+
+UNARY_OPS = {
+    "PLUS": "op_POS",
+    "MINUS": "op_NEG",
+    "NOT": "op_NOT",
+}
+
+# (left type, op token type, right type or None when unary) -> function or None when invalid
+operations = {}
+value_types = []
+
+def resolve_operation(left: type, op: str, right: type | None):
+    if right is not None:
+        # A right value with rop_ knows how to combine with what is on its left
+        if left is not right and hasattr(right, "rop_" + op):
+            reflected = getattr(right, "rop_" + op)
+            return lambda x, y: reflected(y, x)
+        if hasattr(left, "op_" + op):
+            return getattr(left, "op_" + op)
+        return BINARY_FALLBACKS.get(op)
+
+    if op not in UNARY_OPS:
+        return None
+    if hasattr(left, UNARY_OPS[op]):
+        return getattr(left, UNARY_OPS[op])
+    return lambda x: None
+
+def register_value(value_type: type):
+    # Fills the table for every pairing with the types registered so far; types
+    # never registered are still resolved on first use.
+    value_types.append(value_type)
+    for op in BINARY_OPS:
+        for other in value_types:
+            operations[(value_type, op, other)] = resolve_operation(value_type, op, other)
+            operations[(other, op, value_type)] = resolve_operation(other, op, value_type)
+    for op in UNARY_OPS:
+        operations[(value_type, op, None)] = resolve_operation(value_type, op, None)
+
+for value_type in (Num, String, Rope, Bool, Nil, Function, Tuple):
+    register_value(value_type)
 
 ##########################################
 ##                                      ##
@@ -22,102 +72,205 @@ class NodeVisitor(object):
 ##                                      ##
 ##########################################
 
+# Calls nested deeper than this are reported as an error instead of growing the stacks forever
+MAX_DEPTH = 100000
+
 class Interpreter(NodeVisitor):
+    # Visitors that have children are generators: they yield a child node and
+    # get its value sent back. evaluate() drives them from an explicit stack,
+    # so nesting and recursion in a program never recurse in Python.
     def __init__(self, tree) -> None:
         self.tree = tree
+        self.visitors = {}
+        self.global_scope = None
 
     def get_scope(self):
-        if len(self.scope_stack) == 0: return None
-        return self.scope_stack[-1]
+        if len(self.frames) == 0: return None
+        return self.frames[-1]
 
     def get_global_scope(self):
-        if len(self.scope_stack) == 0: return None
-        return self.scope_stack[0]
+        if len(self.frames) == 0: return None
+        return self.frames[0]
 
     def operate(self, op: str, x, y = None):
-        if y != None:
-
-            if hasattr(x, "op_" + op):
-                return getattr(x, "op_" + op)(y)
-            elif op == "EQUALS":
-                return Bool(y) 
-            elif op == "EQUALSE":
-                return x == y
-            elif op == "BANGE":
-                return x != y
-            elif op == "LESSER":
-                return x < y
-            elif op == "LESSERE":
-                return x <= y
-            elif op == "GREATER":
-                return x > y
-            elif op == "GREATERE":
-                return x >= y
-            elif op == "OR":
-                return x or y
-            elif op == "AND":
-                return x and y
-            else:
-                self.error(f"Invalid operation {type(x).__name__} {op} {type(y).__name__}")
+        if y is not None:
+            key = (type(x), op, type(y))
         else:
-            if op == "PLUS":
-                if hasattr(x, "op_POS"):
-                    return getattr(x, "op_POS")()
-            elif op == "MINUS":
-                if hasattr(x, "op_NEG"):
-                    return getattr(x, "op_NEG")()
-            elif op == "NOT":
-                if hasattr(x, "op_NOT"):
-                    return getattr(x, "op_NOT")()
+            key = (type(x), op, None)
+
+        try:
+            operation = operations[key]
+        except KeyError:
+            operation = operations[key] = resolve_operation(*key)
+
+        if operation is None:
+            if y is not None:
+                self.error(f"Invalid operation {type(x).__name__} {op} {type(y).__name__}")
             else:
                 self.error(f"Invalid operation {op} {type(x).__name__}")
 
+        try:
+            if y is not None:
+                return operation(x, y)
+            return operation(x)
+        except OperationError as ex:
+            self.error(str(ex))
+
     def error(self, reason, oindex: int = 0):
+        output.flush()
         print(f"\n{colorama.Fore.RED}{underline_char}Interpreting Error <OI {oindex}>{colorama.Style.RESET_ALL}{colorama.Fore.CYAN}{colorama.Style.RESET_ALL}\n{reason}\n")
-        exit()
+        sys.exit()
+
+    def evaluate(self, node):
+        visitors = self.visitors
+        stack = self.stack = []
+
+        value = node
+        while True:
+            visitor = visitors.get(type(value))
+            if visitor is None:
+                visitor = visitors[type(value)] = getattr(self, "visit_" + type(value).__name__, self.generic_visit)
+            value = visitor(value)
+
+            if type(value) == GeneratorType:
+                stack.append(value)
+                value = None
+
+            while stack:
+                try:
+                    value = stack[-1].send(value)
+                    break
+                except StopIteration as result:
+                    stack.pop()
+                    value = result.value
+            else:
+                return value
+
+    def statements(self, statements: list):
+        for statement in statements:
+            if type(statement) == Return:
+                return (yield statement.token)
+            value = yield statement
+            if value is BREAK or value is CONTINUE:
+                return value
+        return NIL
 
     def visit_Call(self, node):
         params = []
         for parameter in node.parameters.values:
-            params.append(self.visit(parameter))
+            params.append((yield parameter))
+
+        func = yield node.left
+        if not isinstance(func, Function):
+            self.error(f"Cannot call {type(func).__name__}")
+        memo = func.memo
+        if memo is None:
+            memo = get_memo(func)
 
-        return self.visit(self.visit(node.left).call(params))
+        key = None
+        if memo:
+            key = memo.key(params)
+            if key is not None:
+                value = memo.get(key)
+                if value is not None:
+                    return value
+
+        if node.tail:
+            # Handed back up to the enclosing visit_Frame, which swaps it in
+            # for the current activation instead of stacking a new one. Its
+            # result is stored by whichever call started the chain.
+            value = func.call(params)
+            if type(value) == Error:
+                self.error(value.token.value)
+            return value
+
+        # Builtins hand back their value directly, only user functions need a Frame run
+        value = func.call(params)
+        if type(value) == Frame:
+            if self.depth >= MAX_DEPTH:
+                self.error(f"Maximum call depth exceeded ({MAX_DEPTH})")
+            self.depth += 1
+            value = yield value
+            self.depth -= 1
+        elif type(value) == Error:
+            self.error(value.token.value)
+
+        if key is not None:
+            memo.put(key, value)
+        return value
+
+    def visit_Frame(self, frame):
+        frames = self.frames
+        frames.append(frame)
+        value = yield from self.statements(frame.scope.statements)
+        while type(value) == Frame:
+            frames[-1] = value
+            value = yield from self.statements(value.scope.statements)
+        frames.pop()
+        return value
 
     def visit_BinOp(self, node):
-        return self.operate(node.op.type, self.visit(node.left), self.visit(node.right))
+        left = yield node.left
+        right = yield node.right
+        return self.operate(node.op.type, left, right)
 
     def visit_UnaryOp(self, node):
-        return self.operate(node.op.type, self.visit(node.expr))
+        return self.operate(node.op.type, (yield node.expr))
 
     def visit_Scope(self, node):
-        node.init_vars()
-        self.scope_stack.append(node)
-        for statement in node.statements:
-            val = Nil()
-            if type(statement).__name__ == "Return":
-                val = self.visit(statement.token)
-                break
-            self.visit(statement)
-        if len(self.scope_stack) > 1:
-            self.scope_stack.pop()
-            node.vars = None
+        if node.shares:
+            variables = self.frames[-1].vars
         else:
-            self.global_scope = self.scope_stack[0]
-            del self.scope_stack
-        return val
+            variables = Environment(self.frames[-1].vars)
+
+        # Blocks are not activations, a tail call's Frame passes through them
+        frames = self.frames
+        frames.append(Frame(node, variables))
+        value = yield from self.statements(node.statements)
+        frames.pop()
+        return value
 
     def visit_If(self, node):
-        val = self.visit(node.condition)
+        val = yield node.condition
         if val.bool():
-            return self.visit(node.result)
-        return Nil()
+            return (yield node.result)
+        return NIL
+
+    def visit_For(self, node):
+        iterable = yield node.iterable
+        iterator = iterable.iterate()
+        if iterator is None:
+            self.error(f"Cannot loop over {type(iterable).__name__}")
+
+        var_name = node.var.value
+        variables = self.frames[-1].vars
+        for value in iterator:
+            variables[var_name] = value
+            if (yield node.body) is BREAK:
+                break
+        return NIL
+
+    def visit_While(self, node):
+        while (yield node.condition).bool():
+            if (yield node.body) is BREAK:
+                break
+        return NIL
+
+    def visit_Break(self, _):
+        return BREAK
+
+    def visit_Continue(self, _):
+        return CONTINUE
+
+    def visit_Return(self, node):
+        return (yield node.token)
 
     def visit_Error(self, node):
-        self.error(node.token.token.value)
+        self.error(node.token.value)
 
     def visit_Reassign(self, node):
         var_name = node.left.value
-        value = self.visit(node.right)
+        value = yield node.right
         before = self.get_scope().get_var(var_name)
         self.get_scope().set_var(var_name, self.operate(node.token.type, before, value))
 
@@ -125,7 +278,7 @@ class Interpreter(NodeVisitor):
 
     def visit_Assign(self, node):
         var_name = node.left.value
-        value = self.visit(node.right)
+        value = yield node.right
         if not node.public:
             self.get_scope().set_var(var_name, value)
         else:
@@ -134,18 +287,23 @@ class Interpreter(NodeVisitor):
         return value
 
     def visit_Nil(self, _):
-        return Nil()
+        return NIL
 
     def visit_Var(self, node):
         var_name = node.value
-        value = self.get_scope().get_var(var_name)
+        value = self.frames[-1].get_var(var_name)
         if value != None:
             return value
         else:
             self.error(f"Invalid Variable: {var_name}")
     
     def visit_Function(self, node):
-        return node
+        return Function(node.parameters, node.scope, self.frames[-1].vars)
+
+    def make_function(self, node, env: Environment):
+        # The value a Function node becomes in this engine, for functions
+        # that are not created by running their definition, e.g. snapshots
+        return Function(node.parameters, node.scope, env)
 
     def visit_String(self, node):
         return node
@@ -156,11 +314,22 @@ class Interpreter(NodeVisitor):
     def visit_Num(self, node):
         return node
 
-    def interpret(self, file: str | list | tuple = ''):
+    def feed(self, tree, file: str | list | tuple = ''):
+        # Runs another program against the globals left by the earlier ones,
+        # so a REPL entry is parsed on its own but sees what came before it
+        variables = None
+        if self.global_scope is not None:
+            variables = self.global_scope.vars
+        self.tree = tree
+        return self.interpret(file, variables)
+
+    def interpret(self, file: str | list | tuple = '', variables: Environment = None):
         tree = self.tree
         if tree is None:
             return ''
 
-        self.scope_stack = []
-        return self.visit(tree)
-    
\ No newline at end of file
+        if variables is None: variables = Environment(default_vars)
+        self.global_scope = Frame(tree, variables)
+        self.frames = []
+        self.depth = 0
+        return self.evaluate(self.global_scope)
@@ -1,4 +1,8 @@
-import colorama
+import re, sys
+import src.libs.output as output
+from src.libs.lazy import colorama
+from src.sourcemap import SourceMap
+from collections.abc import Iterable
 
 ##########################################
 ##                                      ##
@@ -46,10 +50,49 @@ RESERVED = {
     "or": "OR",
     "not": "NOT",
     "error": "ERROR",
+    "for": "FOR",
+    "in": "IN",
+    "while": "WHILE",
+    "break": "BREAK",
+    "continue": "CONTINUE",
 }
 
+# Every op, including the '*E' comparison and doubled ops built from EQ_OPS and DO_OPS
+OP_TYPES = dict(OPS)
+for op in EQ_OPS:
+    OP_TYPES[op + '='] = OPS[op] + 'E'
+for op in DO_OPS:
+    OP_TYPES[op * 2] = OPS[op] * 2
+
+KEYWORDS = {}
+for word, kind in RESERVED.items():
+    KEYWORDS[word] = kind if type(kind) == tuple else (kind, None)
+
+# One match per token: leading whitespace and comments are captured first so
+# positions can be tracked from match lengths alone. The token itself is
+# optional so trailing whitespace still matches in place rather than letting
+# finditer search ahead into it. Identifiers and numbers never take a period
+# that starts a '..', which the number group matches on its own, along with a
+# lone '.'. Quotes that don't close before an escape fall through to
+# Tokenizer.make_string.
+MASTER_PATTERN = re.compile(r'((?:[ \n\t\r]+|#[^\n]*)*)(?:' + '|'.join((
+    r'([a-zA-Z_](?:[a-zA-Z_0-9]|\.(?!\.))*)',
+    '(' + '|'.join(re.escape(op) for op in sorted(OP_TYPES, key=len, reverse=True) if op[0] not in NUMBER) + ')',
+    r'([0-9]+(?:\.(?!\.)[0-9]*)?|\.[0-9]+|\.\.?)',
+    r'"([^"\\]*)"',
+    r"'([^'\\]*)'",
+    r'(["\'])',
+    r'([^ \n\t\r])',
+)) + ')?')
+match_groups = re.Match.groups
+
 underline_char = '\033[1;4m'
 
+def program_map(source: str) -> SourceMap:
+    # Offsets counted like token oindexes, which start after the '{' the
+    # Tokenizer wraps a program in
+    return SourceMap(source, 1)
+
 class Token:
     def __init__(self, type: str, value, oindex) -> None:
         self.type = type
@@ -63,15 +106,34 @@ class Token:
         return f"Token(\"{self.type}\", {no_newlines})"
 
 class Tokenizer:
-    def __init__(self, source: str) -> None:
-        self.source = '{' + source + '\n}'
-    
+    def __init__(self, source: str | Iterable[str]) -> None:
+        # A string is tokenized in place; any other iterable is read one chunk at
+        # a time, keeping only the unconsumed text in self.source. Line starts
+        # are kept for all of it in self.source_map.
+        if type(source) == str:
+            self.source = '{' + source + '\n}'
+            self.source_map = program_map(source + '\n')
+            self.chunks = None
+        else:
+            self.source = '{'
+            self.source_map = program_map('')
+            self.chunks = iter(source)
+        self.offset = 0
+
+    def locate(self, oindex: int):
+        line = self.source_map.line(oindex)
+        start = max(self.source_map.line_start(line) - self.offset, 0)
+        end = self.source.find('\n', start)
+        if end == -1:
+            end = len(self.source)
+
+        read_row = self.source[start:oindex - self.offset + 1]
+        full_row = self.source[start:end]
+
+        return line, read_row, full_row
+
     def error(self, reason: str = "Failed to tokenize", length: int = 1):
-        read = '\n' + self.source[:self.pos + 1]
-        
-        read_row = read[read.rfind('\n'):][1:]
-        line = read.count('\n')
-        full_row = self.source.split('\n')[line - 1]
+        line, read_row, full_row = self.locate(self.pos)
 
         if type(self.filename) in (list, tuple):
             filename = self.filename[-1]
@@ -80,127 +142,136 @@ class Tokenizer:
 
         arrows = ' '*(len(read_row) - length) + '^' * length
 
+        output.flush()
         print(f"\n{colorama.Fore.RED}{underline_char}Lexing Error{colorama.Style.RESET_ALL}\n {colorama.Fore.CYAN}<{filename}>: Line {line}{colorama.Style.RESET_ALL}\n{full_row}\n{colorama.Fore.YELLOW}{arrows}\n{colorama.Style.RESET_ALL}{reason}\n")
-        exit()
+        sys.exit()
 
-    def next(self) -> None:
-        self.pos += 1
-        if self.pos >= len(self.source):
-            self.char = None
+    def refill(self, keep: int) -> int:
+        # Drops consumed text before the line holding `keep` (still needed for
+        # error rows), then appends the next chunk. Returns how far positions moved.
+        start = self.source.rfind('\n', 0, keep) + 1
+        if start:
+            self.offset += start
+            self.source = self.source[start:]
+
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.source += '\n}'
+            self.source_map.extend('\n')
+            self.chunks = None
         else:
-            self.char = self.source[self.pos]
-    
-    def make_number(self):
-        token = ''
-        oindex = self.pos
-        periods = 0
+            self.source += chunk
+            self.source_map.extend(chunk)
+        return start
 
-        while self.char != None and self.char in NUMBER:
-            if self.char == '_':
-                continue
-            token += self.char
-
-            if self.char == '.':
-                periods += 1
-                if periods == 2:
-                    self.next()
-                    return Token('NUMBER', float(token[0:-1]), oindex), Token('DOTDOT', '..', oindex)
-
-            self.next()
-        return Token('NUMBER', float(token), oindex), None
-
-    def make_identifier(self):
-        token = ''
-        oindex = self.pos
-
-        while self.char != None and self.char in IDENTIFIER:
-            token += self.char
-            self.next()
-        
-        if token in RESERVED:
-            if type(RESERVED[token]) == tuple:
-                return Token(RESERVED[token][0], RESERVED[token][1], oindex)
-            else:
-                return Token(RESERVED[token], None, oindex)
-            
-        return Token('ID', token, oindex)
-
-    def make_op(self):
-        token = self.char
-        oindex = self.pos
-        self.next()
-
-        if self.char == '=' and token in EQ_OPS:
-            self.next()
-            return Token(OPS[token] + 'E', token + '=', oindex)
-        elif self.char == token and token in DO_OPS:
-            self.next()
-            return Token(OPS[token]*2, token + token, oindex)
-
-        return Token(OPS[token], token, oindex)
-    
-    def make_string(self):
-        cap = self.char
-        token = ''
-        oindex = self.pos
-        self.next()
-        while self.char != None and self.char != cap:
-            if self.char == ESCAPE_SEQUENCE:
-                self.next()
-                if self.char == "n":
-                    token += '\n'
-                elif self.char == '\\':
-                    token += '\\'
-                elif self.char == '"':
-                    token += '"'
-                elif self.char == "'":
-                    self.char += "'"
-                elif self.char in '0123456789_':
-                    num = ''
-                    while self.char in '0123456789_':
-                        num += self.char
-                        self.next()
-                    token += chr(int(num))
-                    if self.char != '\\':
-                        token += self.char
-            else:
-                token += self.char
-            self.next()
-        self.next()
-        return Token('STRING', token, oindex)
-
-            
-    def tokenize(self, filename: str | list | tuple = ''):
-        self.pos = -1
-        self.next()
+    def make_string(self, pos: int):
+        source = self.source
+        length = len(source)
+        cap = source[pos]
+
+        parts = []
+        index = pos + 1
+        while True:
+            close = source.find(cap, index)
+            escape = source.find(ESCAPE_SEQUENCE, index, length if close == -1 else close)
+            stop = escape if escape != -1 else close if close != -1 else length
+            parts.append(source[index:stop])
+            index = stop
+            if escape == -1:
+                break
+
+            index += 1
+            char = source[index]
+            if char == "n":
+                parts.append('\n')
+            elif char == '\\':
+                parts.append('\\')
+            elif char == '"':
+                parts.append('"')
+            elif char in '0123456789_':
+                start = index
+                while source[index] in '0123456789_':
+                    index += 1
+                parts.append(chr(int(source[start:index])))
+                if source[index] != '\\':
+                    parts.append(source[index])
+            index += 1
+
+        return ''.join(parts), index + 1
+
+    def tokens(self, filename: str | list | tuple = ''):
         self.filename = filename
+        token = None
+        pos = 0
+
+        while True:
+            source = self.source
+            offset = self.offset
+            streaming = self.chunks is not None
+            # While more input may follow, only scan up to the last newline:
+            # no token but a string can run across one, and make_string reads
+            # past the end itself.
+            end = source.rfind('\n') + 1 if streaming else len(source)
+            exhausted = True
 
-        tokens = []
-
-        while self.char != None:
-            if self.char in NUMBER:
-                x, y = self.make_number()
-                tokens.append(x)
-                if y != None:
-                    tokens.append(y)
-            elif self.char in IDENTIFIER:
-                tokens.append(self.make_identifier())
-            elif self.char in OPS:
-                tokens.append(self.make_op())
-            elif self.char in STRING_CAP:
-                tokens.append(self.make_string())
-            elif self.char in WHITESPACE:
-                self.next()
-            elif self.char == COMMENT:
-                while self.char not in (None, '\n'):
-                    self.next()
-            else:
-                self.error(f"Invalid Character: '{self.char}'")
-        
-        tokens.append(Token("EOF", None, len(self.source)))
-        return tokens
+            for skipped, identifier, op, number, dq_string, sq_string, cap, invalid in map(match_groups, MASTER_PATTERN.finditer(source, pos, end)):
+                pos += len(skipped)
+                if identifier is not None:
+                    keyword = KEYWORDS.get(identifier)
+                    if keyword is None:
+                        token = Token('ID', identifier, offset + pos)
+                    else:
+                        token = Token(keyword[0], keyword[1], offset + pos)
+                    pos += len(identifier)
+                elif op is not None:
+                    token = Token(OP_TYPES[op], op, offset + pos)
+                    pos += len(op)
+                elif number is not None:
+                    if number[-1] == '.' and number[0] == '.':
+                        token = Token(OP_TYPES[number], number, offset + pos)
+                    else:
+                        token = Token('NUMBER', float(number), offset + pos)
+                    pos += len(number)
+                elif dq_string is not None:
+                    token = Token('STRING', dq_string, offset + pos)
+                    pos += len(dq_string) + 2
+                elif sq_string is not None:
+                    token = Token('STRING', sq_string, offset + pos)
+                    pos += len(sq_string) + 2
+                elif cap is not None:
+                    try:
+                        value, stop = self.make_string(pos)
+                    except IndexError:
+                        stop = None
+                    if streaming and (stop is None or stop > len(source)):
+                        break
+                    token = Token('STRING', value, offset + pos)
+                    pos = stop
+                    exhausted = False
+                    yield token
+                    break
+                elif invalid is not None:
+                    self.pos = offset + pos
+                    self.error(f"Invalid Character: '{invalid}'")
+                else:
+                    continue
+                yield token
+
+            if not exhausted:
+                continue
+            if not streaming:
+                break
+
+            keep = pos if token is None else min(pos, token.oindex - offset)
+            pos -= self.refill(keep)
+
+        yield Token("EOF", None, self.offset + len(self.source))
+
+    def tokenize(self, filename: str | list | tuple = ''):
+        return list(self.tokens(filename))
 
+# Run with python -m src.lexer
 if __name__ == "__main__":
-    import libs.longinput
+    import src.libs.longinput as longinput
     while True:
-        print('\n' + str(Tokenizer(libs.longinput.long_input()).tokenize('stdin')))
\ No newline at end of file
+        print('\n' + str(Tokenizer(longinput.long_input()).tokenize('stdin')))
\ No newline at end of file
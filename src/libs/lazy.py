@@ -0,0 +1,12 @@
+import importlib
+
+class LazyModule:
+    # Stands in for a module that is only imported once one of its attributes
+    # is used, e.g. colorama, which is only needed to print errors in color
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __getattr__(self, attribute: str):
+        return getattr(importlib.import_module(self.name), attribute)
+
+colorama = LazyModule("colorama")
@@ -1,4 +1,5 @@
-import colorama, os
+import os
+from src.libs.lazy import colorama
 
 def long_input():
     source = ''
@@ -24,9 +25,20 @@ def long_input():
     
     return source
 
+def file_path(file: str):
+    return os.path.join('lang', file)
+
 def file_input(file: str):
-    file = open(os.path.join('lang', file), "r")
+    file = open(file_path(file), "r")
     source = file.read()
     file.close()
     return source
-    
\ No newline at end of file
+    
+
+def file_stream(file: str, size: int = 1 << 16):
+    with open(file_path(file), "r") as stream:
+        while True:
+            chunk = stream.read(size)
+            if chunk == '':
+                break
+            yield chunk
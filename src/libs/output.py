@@ -0,0 +1,38 @@
+import atexit, sys
+
+# Characters of program output held before they are written out, 0 writes
+# every print straight to the sink
+BUFFER_SIZE = 1 << 16
+
+# Anything with write(str), and optionally flush(). None means sys.stdout,
+# looked up on every flush so a redirected stdout is still followed.
+sink = None
+
+buffer = []
+buffered = 0
+
+def set_sink(new_sink) -> None:
+    # Output written so far still goes to the old sink
+    global sink
+    flush()
+    sink = new_sink
+
+def write(text: str) -> None:
+    global buffered
+    buffer.append(text)
+    buffered += len(text)
+    if buffered >= BUFFER_SIZE:
+        flush()
+
+def flush() -> None:
+    # Called before anything else prints, e.g. errors, so output stays in order
+    global buffered
+    target = sys.stdout if sink is None else sink
+    if buffer:
+        target.write(''.join(buffer))
+        buffer.clear()
+        buffered = 0
+    if hasattr(target, 'flush'):
+        target.flush()
+
+atexit.register(flush)
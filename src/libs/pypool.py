@@ -0,0 +1,133 @@
+import multiprocessing, os, time
+from multiprocessing.connection import wait
+from collections import deque
+from types import NoneType
+
+# Only these can be sent back and turned into values by py_eval
+RESULT_TYPES = (str, int, float, NoneType)
+
+def worker_main(connection, persist: bool):
+    import src.builtin as builtin
+    builtin.PYTHON_PERSIST = persist
+
+    while True:
+        try:
+            source = connection.recv()
+        except EOFError:
+            break
+        if source is None:
+            break
+
+        try:
+            value = builtin.python_main(source)()
+            if type(value) in RESULT_TYPES:
+                result = ('ok', value)
+            else:
+                result = ('error', f"Cannot evaluate type: <{type(value).__name__}>")
+        except Exception as ex:
+            result = ('error', ' '.join(str(arg) for arg in ex.args))
+        connection.send(result)
+
+class Job:
+    __slots__ = ('id', 'source', 'timeout', 'deadline', 'done', 'result')
+
+    def __init__(self, id: int, source: str, timeout: float) -> None:
+        self.id = id
+        self.source = source
+        self.timeout = timeout
+        self.deadline = None
+        self.done = False
+        self.result = None
+
+class Worker:
+    def __init__(self, persist: bool) -> None:
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=worker_main, args=(child, persist), daemon=True)
+        self.process.start()
+        child.close()
+        self.job = None
+
+    def send(self, job: Job) -> None:
+        self.job = job
+        job.deadline = time.monotonic() + job.timeout
+        self.connection.send(job.source)
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+class PythonPool:
+    # Runs python() sources in worker processes that are reused between calls.
+    # Jobs are queued by start() and handed to idle workers whenever the pool
+    # is waited on; a worker that runs past its job's timeout is killed and
+    # replaced, and the job fails instead of blocking the interpreter.
+    def __init__(self, size: int = None, timeout: float = 10.0, persist: bool = False) -> None:
+        self.size = size or os.cpu_count() or 1
+        self.timeout = timeout
+        self.persist = persist
+        self.workers = [Worker(persist) for _ in range(self.size)]
+        self.queue = deque()
+        self.jobs = {}
+        self.next_id = 0
+
+    def start(self, source: str, timeout: float = None) -> int:
+        self.next_id += 1
+        job = self.jobs[self.next_id] = Job(self.next_id, source, timeout or self.timeout)
+        self.queue.append(job)
+        self.dispatch()
+        return job.id
+
+    def dispatch(self) -> None:
+        for worker in self.workers:
+            if not self.queue:
+                break
+            if worker.job is None:
+                worker.send(self.queue.popleft())
+
+    def finish(self, worker: Worker, result) -> None:
+        worker.job.done = True
+        worker.job.result = result
+        worker.job = None
+
+    def replace(self, index: int, reason: str) -> None:
+        worker = self.workers[index]
+        self.finish(worker, ('error', reason))
+        worker.kill()
+        self.workers[index] = Worker(self.persist)
+
+    def poll(self, timeout: float) -> None:
+        busy = {worker.connection: index for index, worker in enumerate(self.workers) if worker.job is not None}
+        for connection in wait(list(busy), timeout):
+            index = busy[connection]
+            try:
+                self.finish(self.workers[index], connection.recv())
+            except EOFError:
+                self.replace(index, "python() worker exited")
+
+        now = time.monotonic()
+        for index, worker in enumerate(self.workers):
+            if worker.job is not None and worker.job.deadline <= now:
+                self.replace(index, f"python() timed out after {worker.job.timeout:g}s")
+
+    def wait(self, id: int):
+        # Returns the value main() gave back, or an Exception for py_eval
+        job = self.jobs.get(id)
+        if job is None:
+            return Exception(f"No python() job {id}")
+
+        while not job.done:
+            self.dispatch()
+            deadlines = [worker.job.deadline for worker in self.workers if worker.job is not None]
+            self.poll(max(0, min(deadlines) - time.monotonic()))
+
+        del self.jobs[id]
+        status, value = job.result
+        if status == 'error':
+            return Exception(value)
+        return value
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.kill()
+        self.workers = []
@@ -0,0 +1,43 @@
+from time import perf_counter
+
+PHASES = ("import", "cache", "lex", "parse", "optimize", "run")
+
+class StartupProfile:
+    # Wall time of each phase of one run, from the start of main.py. Lexing
+    # happens inside parsing as the parser pulls tokens, so it is timed token
+    # by token and taken back out of the parse time in the report.
+    def __init__(self, start: float) -> None:
+        self.start = start
+        self.last = start
+        self.phases = dict.fromkeys(PHASES, 0.0)
+
+    def mark(self, phase: str) -> None:
+        # The time since the previous mark went into this phase
+        now = perf_counter()
+        self.phases[phase] += now - self.last
+        self.last = now
+
+    def timed_tokens(self, tokens):
+        # Wraps Tokenizer.tokens so the time spent lexing is counted
+        phases = self.phases
+
+        def timed(filename = ''):
+            iterator = tokens(filename)
+            while True:
+                start = perf_counter()
+                token = next(iterator, None)
+                phases["lex"] += perf_counter() - start
+                if token is None:
+                    return
+                yield token
+        return timed
+
+    def report(self) -> str:
+        phases = dict(self.phases)
+        phases["parse"] -= phases["lex"]
+
+        lines = [f"{'phase':<10} {'ms':>9}"]
+        for phase in PHASES:
+            lines.append(f"{phase:<10} {phases[phase] * 1000:>9.3f}")
+        lines.append(f"{'total':<10} {(self.last - self.start) * 1000:>9.3f}")
+        return '\n'.join(lines)
@@ -0,0 +1,239 @@
+from src.parsetokens import NodeVisitor, Function, Var, Num, String, Bool, Nil
+from collections import OrderedDict
+from types import FunctionType
+import weakref
+
+# Results kept per function found pure. 0 turns off memoizing those, functions
+# marked with memo() are still memoized and keep MARKED_SIZE results then.
+MEMO_SIZE = 0
+MARKED_SIZE = 1024
+
+KEY_TYPES = (Num, String, Bool, Nil)
+
+# Every Memo whose function is still around, for memo_report()
+memos = weakref.WeakSet()
+
+##########################################
+##                                      ##
+##  Purity                              ##
+##                                      ##
+##########################################
+
+class Purity(NodeVisitor):
+    # Walks a function body once, tracking which names are bound inside it.
+    # The body is pure when it never writes outside itself, never reads a
+    # variable that is not its own, and only calls functions by name. Those
+    # names are kept in callees and looked up when the function is called.
+    def __init__(self) -> None:
+        self.pure = True
+        self.callees = set()
+        self.bound = set()
+
+    def analyse(self, function):
+        self.bound = {identifier.value for identifier in function.parameters.identifiers}
+        self.visit(function.scope)
+        return self.pure, frozenset(self.callees)
+
+    def generic_visit(self, node):
+        self.pure = False
+
+    def visit_Scope(self, node):
+        if node.shares:
+            for statement in node.statements:
+                self.visit(statement)
+        else:
+            self.visit_apart(node.statements)
+
+    def visit_apart(self, nodes):
+        # Names bound here may never be bound when the code runs, so they
+        # stop counting as the function's own once these nodes are visited
+        bound = self.bound
+        self.bound = set(bound)
+        for node in nodes:
+            self.visit(node)
+        self.bound = bound
+
+    def visit_If(self, node):
+        self.visit(node.condition)
+        self.visit_apart((node.result,))
+
+    def visit_For(self, node):
+        self.visit(node.iterable)
+        bound = self.bound
+        self.bound = set(bound)
+        self.bound.add(node.var.value)
+        self.visit(node.body)
+        self.bound = bound
+
+    def visit_While(self, node):
+        self.visit(node.condition)
+        self.visit_apart((node.body,))
+
+    def visit_Return(self, node):
+        self.visit(node.token)
+
+    def visit_Assign(self, node):
+        if node.public or type(node.right) == Function:
+            self.pure = False
+            return
+        self.visit(node.right)
+        self.bound.add(node.left.value)
+
+    def visit_Reassign(self, node):
+        if node.left.value not in self.bound:
+            self.pure = False
+        self.visit(node.right)
+
+    def visit_Call(self, node):
+        for parameter in node.parameters.values:
+            self.visit(parameter)
+
+        if type(node.left) != Var:
+            self.pure = False
+        elif node.left.value not in self.bound:
+            self.callees.add(node.left.value)
+
+    def visit_Var(self, node):
+        if node.value not in self.bound:
+            self.pure = False
+
+    def visit_BinOp(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.expr)
+
+    def visit_Num(self, node):
+        pass
+
+    visit_String = visit_Bool = visit_Nil = visit_Error = visit_Break = visit_Continue = visit_Num
+
+def is_pure(func, checking: set = None, dependencies: list = None) -> bool:
+    # Every callee looked up is added to dependencies as (env, name, callee),
+    # so the answer can be checked again once one of them is redefined
+    if type(func.scope) == FunctionType:
+        return getattr(func.scope, "pure", False)
+
+    scope = func.scope
+    purity = getattr(scope, "purity", None)
+    if purity is None:
+        purity = scope.purity = Purity().analyse(func)
+
+    pure, callees = purity
+    if not pure:
+        return False
+
+    # Functions calling each other are assumed pure while they are being checked
+    if checking is None: checking = set()
+    checking.add(id(func))
+    for name in callees:
+        callee = func.env.lookup(name)
+        if dependencies is not None:
+            dependencies.append((func.env, name, callee))
+        if not isinstance(callee, Function):
+            return False
+        if id(callee) not in checking and not is_pure(callee, checking, dependencies):
+            return False
+    return True
+
+##########################################
+##                                      ##
+##  Memo                                ##
+##                                      ##
+##########################################
+
+class Memo:
+    # Least recently used results of one function, keyed by its argument values.
+    # A function memoized for being pure also keeps the callees its purity was
+    # decided with, and is only used while all of them are still defined.
+    __slots__ = ('name', 'size', 'arity', 'results', 'hits', 'misses', 'function', 'dependencies', 'pure', '__weakref__')
+
+    def __init__(self, name: str, size: int, arity: int, function = None, dependencies: list = ()) -> None:
+        self.name = name
+        self.size = size
+        self.arity = arity
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.function = function
+        self.dependencies = tuple(dependencies)
+        self.pure = True
+        memos.add(self)
+
+    def current(self) -> bool:
+        for env, name, callee in self.dependencies:
+            if env.lookup(name) is not callee:
+                break
+        else:
+            return self.pure
+
+        # A callee was redefined, so the results may be stale and the function
+        # may not be pure anymore
+        self.results.clear()
+        dependencies = []
+        self.pure = is_pure(self.function, None, dependencies)
+        self.dependencies = tuple(dependencies)
+        return self.pure
+
+    def key(self, params: list):
+        if len(params) < self.arity:
+            return None
+        if self.dependencies and not self.current():
+            return None
+
+        key = []
+        for index in range(self.arity):
+            value = params[index]
+            if type(value) not in KEY_TYPES:
+                return None
+            key.append((type(value), value.value))
+        return tuple(key)
+
+    def get(self, key):
+        value = self.results.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.results.move_to_end(key)
+        return value
+
+    def put(self, key, value) -> None:
+        results = self.results
+        results[key] = value
+        if len(results) > self.size:
+            results.popitem(last=False)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+def function_name(func) -> str:
+    for name, value in func.env.items():
+        if value is func:
+            return name
+    return '<anonymous>'
+
+def make_memo(func, size: int = None, dependencies: list = ()) -> Memo:
+    if size is None: size = MEMO_SIZE or MARKED_SIZE
+    return Memo(function_name(func), size, len(func.parameters.identifiers), func, dependencies)
+
+def get_memo(func):
+    # Called the first time a function value is called. Its memo is then
+    # either a Memo or False, so the check is never repeated for that value.
+    # A Memo checks the callees it depends on itself, see Memo.current.
+    func.memo = False
+    if MEMO_SIZE > 0 and type(func.scope) != FunctionType:
+        dependencies = []
+        if is_pure(func, None, dependencies):
+            func.memo = make_memo(func, dependencies=dependencies)
+    return func.memo
+
+def memo_report() -> str:
+    lines = [f"{'function':<20} {'hits':>8} {'misses':>8} {'rate':>7} {'size':>6}"]
+    for memo in sorted(memos, key=lambda memo: memo.hits + memo.misses, reverse=True):
+        lines.append(f"{memo.name:<20} {memo.hits:>8} {memo.misses:>8} {memo.hit_rate():>7.1%} {len(memo.results):>6}")
+    return '\n'.join(lines)
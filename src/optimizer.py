@@ -0,0 +1,210 @@
+from src.interpreter import NodeVisitor, operations, resolve_operation
+from src.parsetokens import Num, String, Bool, Nil, NIL
+from time import perf_counter
+
+LITERALS = (Num, String, Bool, Nil)
+
+##########################################
+##                                      ##
+##  Passes                              ##
+##                                      ##
+##########################################
+
+class Pass(NodeVisitor):
+    # A pass rewrites the tree in place. Every visit_ method returns the node
+    # that should take the place of the one it was given, so a pass only has
+    # to override the nodes it cares about and call the default for the rest.
+    name = "pass"
+
+    def __init__(self) -> None:
+        self.visited = 0
+        self.changes = 0
+
+    def visit(self, node):
+        self.visited += 1
+        return super().visit(node)
+
+    def generic_visit(self, node):
+        return node
+
+    def run(self, tree):
+        return self.visit(tree)
+
+    def visit_Scope(self, node):
+        node.statements = [self.visit(statement) for statement in node.statements]
+        return node
+
+    def visit_Return(self, node):
+        node.token = self.visit(node.token)
+        return node
+
+    def visit_If(self, node):
+        node.condition = self.visit(node.condition)
+        node.result = self.visit(node.result)
+        return node
+
+    def visit_For(self, node):
+        node.iterable = self.visit(node.iterable)
+        node.body = self.visit(node.body)
+        return node
+
+    def visit_While(self, node):
+        node.condition = self.visit(node.condition)
+        node.body = self.visit(node.body)
+        return node
+
+    def visit_Assign(self, node):
+        node.right = self.visit(node.right)
+        return node
+
+    def visit_Reassign(self, node):
+        node.right = self.visit(node.right)
+        return node
+
+    def visit_Call(self, node):
+        node.parameters = self.visit(node.parameters)
+        node.left = self.visit(node.left)
+        return node
+
+    def visit_Tuple(self, node):
+        node.values = [self.visit(value) for value in node.values]
+        return node
+
+    def visit_Function(self, node):
+        node.scope = self.visit(node.scope)
+        return node
+
+    def visit_BinOp(self, node):
+        node.left = self.visit(node.left)
+        node.right = self.visit(node.right)
+        return node
+
+    def visit_UnaryOp(self, node):
+        node.expr = self.visit(node.expr)
+        return node
+
+class ConstantFolding(Pass):
+    # Operations on two literals are done once here with the same operation
+    # table the interpreters use. Anything that would fail or produce a
+    # non-literal is left alone so the error still happens at runtime.
+    name = "constant folding"
+
+    def fold(self, node, key: tuple, *values):
+        try:
+            operation = operations[key]
+        except KeyError:
+            operation = operations[key] = resolve_operation(*key)
+        if operation is None:
+            return node
+
+        try:
+            value = operation(*values)
+        except Exception:
+            return node
+
+        if type(value) not in LITERALS:
+            return node
+        self.changes += 1
+        return value
+
+    def visit_BinOp(self, node):
+        super().visit_BinOp(node)
+        left, right = node.left, node.right
+        if type(left) not in LITERALS or type(right) not in LITERALS:
+            return node
+        return self.fold(node, (type(left), node.op.type, type(right)), left, right)
+
+    def visit_UnaryOp(self, node):
+        super().visit_UnaryOp(node)
+        expr = node.expr
+        if type(expr) not in LITERALS:
+            return node
+        return self.fold(node, (type(expr), node.op.type, None), expr)
+
+class DeadBranches(Pass):
+    # An If on a literal condition either always runs its body or never does.
+    # The body shares the enclosing variables, so it can stand in for the If.
+    # A While on a literal false condition never runs at all.
+    name = "dead branches"
+
+    def visit_If(self, node):
+        super().visit_If(node)
+        if type(node.condition) not in LITERALS:
+            return node
+
+        self.changes += 1
+        if node.condition.bool():
+            return node.result
+        return NIL
+
+    def visit_While(self, node):
+        super().visit_While(node)
+        if type(node.condition) not in LITERALS or node.condition.bool():
+            return node
+
+        self.changes += 1
+        return NIL
+
+class LiteralPool(Pass):
+    # Equal Num and String literals all point at the first one seen, so a
+    # literal repeated across the program is only kept in memory once.
+    name = "literal pool"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.pool = {}
+
+    def visit_Num(self, node):
+        # repr keeps 0.0 and -0.0 apart
+        key = (type(node), repr(node.value))
+        pooled = self.pool.setdefault(key, node)
+        if pooled is not node:
+            self.changes += 1
+        return pooled
+
+    visit_String = visit_Num
+
+##########################################
+##                                      ##
+##  Optimizer                           ##
+##                                      ##
+##########################################
+
+DEFAULT_PASSES = [ConstantFolding, DeadBranches, LiteralPool]
+
+class Optimizer:
+    def __init__(self, passes: list = None, enabled: bool = True) -> None:
+        if passes == None: passes = DEFAULT_PASSES
+        self.passes = list(passes)
+        self.enabled = enabled
+        self.stats = []
+
+    def add_pass(self, optimizer_pass: type) -> None:
+        self.passes.append(optimizer_pass)
+
+    def signature(self) -> str:
+        # Tells apart trees built with different passes, e.g. in the program cache
+        if not self.enabled:
+            return ''
+        return ','.join(optimizer_pass.name for optimizer_pass in self.passes)
+
+    def optimize(self, tree):
+        self.stats = []
+        if tree is None or not self.enabled:
+            return tree
+
+        for pass_type in self.passes:
+            optimizer_pass = pass_type()
+            start = perf_counter()
+            tree = optimizer_pass.run(tree)
+            self.stats.append((optimizer_pass.name, optimizer_pass.visited, optimizer_pass.changes, perf_counter() - start))
+        return tree
+
+    def report(self) -> str:
+        if not self.enabled:
+            return "Optimizer disabled"
+
+        lines = [f"{'pass':<18} {'nodes':>8} {'changes':>8} {'ms':>8}"]
+        for name, visited, changes, seconds in self.stats:
+            lines.append(f"{name:<18} {visited:>8} {changes:>8} {seconds * 1000:>8.3f}")
+        return '\n'.join(lines)
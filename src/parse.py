@@ -1,4 +1,6 @@
+import sys
 from src.lexer import Token, Tokenizer, colorama, underline_char
+import src.libs.output as output
 from src.parsetokens import *
 
 ##########################################
@@ -12,11 +14,7 @@ class Parser:
         self.tokenizer = tokenizer
     
     def error(self, reason: str):
-        read = '\n' + self.tokenizer.source[:self.tok.oindex + 1]
-        
-        read_row = read[read.rfind('\n'):][1:]
-        line = read.count('\n')
-        full_row = self.tokenizer.source.split('\n')[line - 1]
+        line, read_row, full_row = self.tokenizer.locate(self.tok.oindex)
 
         if type(self.filename) in (list, tuple):
             filename = self.filename[-1]
@@ -25,15 +23,15 @@ class Parser:
 
         arrows = ' '*(len(read_row) - 1) + '^' * len(str(self.tok.value))
 
+        output.flush()
         print(f"\n{colorama.Fore.RED}{underline_char}Parsing Error{colorama.Style.RESET_ALL}\n {colorama.Fore.CYAN}<{filename}>: Line {line} (index: {self.tok.oindex}){colorama.Style.RESET_ALL}\n{full_row}\n{colorama.Fore.YELLOW}{arrows}\n{colorama.Style.RESET_ALL}{reason}\n")
-        exit()
+        sys.exit()
 
     def next(self, *match: str):
-        self.pos += 1
-        if self.pos >= len(self.source):
+        tok = next(self.tokens, None)
+        if tok is None:
             self.error("Expected <EOF>")
-        else:
-            self.tok = self.source[self.pos]
+        self.tok = tok
 
         if match != ():
             if len(match) == 1 and self.tok.type != match[0]:
@@ -57,7 +55,7 @@ class Parser:
             node = UnaryOp(token, self.base())
         elif token.type in ("TRUE", "FALSE"):
             self.next()
-            node = Bool(token)
+            node = Bool(token.value, token.oindex)
         elif token.type == "ID":
             node = self.variable()
         elif token.type == "FUNCTION":
@@ -67,10 +65,10 @@ class Parser:
             node = Nil(token.oindex)
         elif token.type == "NUMBER":
             self.next()
-            node = Num(token)
+            node = Num(token.value, token.oindex)
         elif token.type == "STRING":
             self.next()
-            node = String(token)
+            node = String(token.value, token.oindex)
         elif token.type == "LBRACKET":
             self.next()
             if self.tok.type == "RBRACKET":
@@ -81,7 +79,7 @@ class Parser:
                     self.error("Unclosed Bracket")
                 self.next()
         elif token.type == "LCURLY":
-            node = self.scope()
+            node = self.expression_scope()
         else:
             node = self.variable()
 
@@ -120,14 +118,25 @@ class Parser:
         
         return node
 
-    def bool_relation(self):
+    def range_expr(self):
         node = self.expr()
 
-        while self.tok.type in ("EQUALSE", "BANGE", "LESSER", "GREATER", "LESSERE", "GREATERE"):
+        if self.tok.type == "DOTDOT":
             token = self.tok
             self.next()
 
             node = BinOp(node, token, self.expr())
+
+        return node
+
+    def bool_relation(self):
+        node = self.range_expr()
+
+        while self.tok.type in ("EQUALSE", "BANGE", "LESSER", "GREATER", "LESSERE", "GREATERE"):
+            token = self.tok
+            self.next()
+
+            node = BinOp(node, token, self.range_expr())
         
         return node
 
@@ -221,6 +230,22 @@ class Parser:
         node = Assign(left, right, public)
         return node
     
+    def function_body(self):
+        # A break or continue never reaches a loop outside the function
+        loops, self.loops = self.loops, 0
+        body = self.scope()
+        self.loops = loops
+        mark_tail_calls(body)
+        return body
+
+    def expression_scope(self):
+        # A break or continue only leaves a loop from a statement, never from
+        # a block whose value is being used
+        loops, self.loops = self.loops, 0
+        body = self.scope()
+        self.loops = loops
+        return body
+
     def func_statement(self, public = False, statement = True):
         self.next("ID", "LBRACKET")
         if self.tok.type == "ID":
@@ -228,7 +253,7 @@ class Parser:
                 left = self.tok
                 self.next("LBRACKET")
                 parameters = self.make_tuple(True)
-                right = self.scope()
+                right = self.function_body()
                 node = Assign(left, Function(parameters, right), public)
                 return node
             else:
@@ -238,7 +263,7 @@ class Parser:
                 self.error("Cannot make an anonymous function public")
             else:
                 parameters = self.make_tuple(True)
-                right = self.scope()
+                right = self.function_body()
                 node = Function(parameters, right)
                 return node
         
@@ -255,6 +280,33 @@ class Parser:
         result = self.scope(True)
         return If(condition, result)
 
+    def loop_body(self):
+        # Bodies share the enclosing variables like if bodies, so a loop can
+        # update what was declared before it
+        self.loops += 1
+        body = self.scope(True)
+        self.loops -= 1
+        return body
+
+    def for_statement(self):
+        self.next("ID")
+        var = self.tok
+        self.next("IN")
+        self.next()
+        iterable = self.bool_expr()
+        return For(var, iterable, self.loop_body())
+
+    def while_statement(self):
+        self.next()
+        condition = self.bool_expr()
+        return While(condition, self.loop_body())
+
+    def loop_control(self, node):
+        if self.loops == 0:
+            self.error(f"'{self.tok.type.lower()}' outside of a loop")
+        self.next()
+        return node
+
     def return_statement(self):
         self.next()
         node = self.statement()
@@ -280,6 +332,14 @@ class Parser:
             node = self.empty(self.tok.oindex + 1)
         elif self.tok.type == "IF":
             node = self.if_statement()
+        elif self.tok.type == "FOR":
+            node = self.for_statement()
+        elif self.tok.type == "WHILE":
+            node = self.while_statement()
+        elif self.tok.type == "BREAK":
+            node = self.loop_control(Break())
+        elif self.tok.type == "CONTINUE":
+            node = self.loop_control(Continue())
         else:
             node = self.bool_expr()
         return node
@@ -372,13 +432,15 @@ class Parser:
         return node
 
     def parse(self, filename: str | tuple | list = ''):
-        self.source = self.tokenizer.tokenize(filename)
-        
+        # Tokens are pulled from the tokenizer as the parser needs them, so only
+        # the current token is ever held rather than the whole token list.
+        self.tokens = self.tokenizer.tokens(filename)
+
         self.filename = filename
-        self.pos = -1
         self.next()
 
         self.scope_stack = []
+        self.loops = 0
 
         node = self.program()
         if self.tok.type != "EOF":
@@ -1,56 +1,104 @@
-from copy import deepcopy
 from src.lexer import Token
 from types import FunctionType
-
-default_vars = {}
+from itertools import count, takewhile
+import math
 
 class AST:
-    ...
+    __slots__ = ()
+
+class OperationError(Exception):
+    # Raised by a value's op_ method when the operands themselves are wrong,
+    # reported by the interpreter like any other invalid operation
+    pass
+
+##########################################
+##                                      ##
+##  AST VISITORS                        ##
+##                                      ##
+##########################################
+
+class NodeVisitor(object):
+    def visit(self, node):
+        method_name = "visit_" + type(node).__name__
+        visitor = getattr(self, method_name, self.generic_visit)
+        return visitor(node)
+    
+    def generic_visit(self, node):
+        self.error(f'No visit_{type(node).__name__} method')
 
 class Value(AST):
+    __slots__ = ()
+
     def op_EQUALS(self, other):
         val = other.value
         return val
     def op_EQUALSE(self, other):
-        val = self.value == other.value
-        return Bool(Token("BOOL", val, self.token.oindex))
+        return TRUE if self.value == other.value else FALSE
     def op_BANGE(self, other):
-        val = self.value != other.value
-        return Bool(Token("BOOL", val, self.token.oindex))
+        return TRUE if self.value != other.value else FALSE
     def op_LESSER(self, other):
-        val = self.value < other.value
-        return Bool(Token("BOOL", val, self.token.oindex))
+        return TRUE if self.value < other.value else FALSE
     def op_LESSERE(self, other):
-        val = self.value <= other.value
-        return Bool(Token("BOOL", val, self.token.oindex))
+        return TRUE if self.value <= other.value else FALSE
     def op_GREATER(self, other):
-        val = self.value > other.value
-        return Bool(Token("BOOL", val, self.token.oindex))
+        return TRUE if self.value > other.value else FALSE
     def op_GREATERE(self, other):
-        val = self.value >= other.value
-        return Bool(Token("BOOL", val, self.token.oindex))
+        return TRUE if self.value >= other.value else FALSE
     def op_OR(self, other):
-        val = self.bool() or other.bool()
-        return Bool(Token("BOOL", val, self.token.oindex))
+        return TRUE if self.bool() or other.bool() else FALSE
     def op_AND(self, other):
-        val = self.bool() and other.bool()
-        return Bool(Token("BOOL", val, self.token.oindex))
+        return TRUE if self.bool() and other.bool() else FALSE
     def op_NOT(self):
-        val = not self.bool()
-        return Bool(Token("BOOL", val, self.token.oindex))
+        return TRUE if not self.bool() else FALSE
     def string(self):
         return repr(self)
     def bool(self):
         return True
     def call(self):
-        return Nil()
+        return NIL
+    def iterate(self):
+        # An iterator of values for a for loop, None when this can't be looped over
+        return None
+
+    # Only functions are ever memoized, see src.memo
+    memo = False
+
+class Environment(dict):
+    # One layer of variables chained to the enclosing one. Entering a scope or
+    # calling a function only allocates a new empty layer; reads fall through
+    # to the parents and writes always land in the innermost layer, so a
+    # parent is never copied or modified by its children.
+    __slots__ = ('parent',)
+
+    def __init__(self, parent = None, variables: dict = None) -> None:
+        if variables:
+            super().__init__(variables)
+        self.parent = parent
+
+    def __missing__(self, var):
+        if self.parent is None:
+            raise KeyError(var)
+        return self.parent[var]
+
+    def lookup(self, var):
+        try:
+            return self[var]
+        except KeyError:
+            return None
+
+    def flatten(self) -> dict:
+        if self.parent is None:
+            return dict(self)
+        return self.parent.flatten() | self
+
+# Builtins live in a shared root layer filled in by src.builtin
+default_vars = Environment()
 
 class Scope(AST):
-    def __init__(self, parent, shares, statements: list = None, variables: list = None) -> None:
+    def __init__(self, parent, shares, statements: list = None) -> None:
         if statements == None: statements = []
         self.statements = statements
 
-        self.vars = variables
         self.parent = parent
         self.shares = shares
     
@@ -59,27 +107,24 @@ class Scope(AST):
         for s in self.statements:
             statements.append(repr(s))
         return f"Scope(Scope(...), {self.shares}, {', '.join(statements)})"
-    
+
+class Frame:
+    # One activation of a Scope. Scope nodes are shared by every call of the
+    # same function, so the variables of each call live here instead.
+    __slots__ = ('scope', 'vars')
+
+    def __init__(self, scope: Scope, variables: Environment) -> None:
+        self.scope = scope
+        self.vars = variables
+
+    def __repr__(self) -> str:
+        return f"Frame({self.scope})"
+
     def set_var(self, var, value):
         self.vars[var] = value
-    
+
     def get_var(self, var):
-        return self.vars.get(var)
-    
-    def init_vars(self):
-        if self.vars != None:
-            if self.shares:
-                self.shares = False
-            if self.parent != None:
-                self.vars = self.parent.vars | self.vars
-        else:
-            if self.parent != None:
-                if self.shares:
-                    self.vars = self.parent.vars
-                else:
-                    self.vars = deepcopy(self.parent.vars)
-            else:
-                self.vars = deepcopy(default_vars)
+        return self.vars.lookup(var)
 
 class If(AST):
     def __init__(self, condition, result) -> None:
@@ -89,6 +134,36 @@ class If(AST):
     def __repr__(self) -> str:
         return f"If({self.condition}, {self.result})"
 
+class For(AST):
+    def __init__(self, var, iterable, body) -> None:
+        self.var = var
+        self.iterable = iterable
+        self.body = body
+
+    def __repr__(self) -> str:
+        return f"For({self.var}, {self.iterable}, {self.body})"
+
+class While(AST):
+    def __init__(self, condition, body) -> None:
+        self.condition = condition
+        self.body = body
+
+    def __repr__(self) -> str:
+        return f"While({self.condition}, {self.body})"
+
+class Break(AST):
+    def __repr__(self) -> str:
+        return "Break()"
+
+class Continue(AST):
+    def __repr__(self) -> str:
+        return "Continue()"
+
+# What a break or continue evaluates to, passed up through the scopes around
+# it until the loop sees it
+BREAK = Break()
+CONTINUE = Continue()
+
 class Error(AST):
     def __init__(self, token) -> None:
         self.token = token
@@ -133,10 +208,33 @@ class Call(AST):
     def __init__(self, left, parameters) -> None:
         self.left = left
         self.parameters = parameters
+        self.tail = False
 
     def __repr__(self) -> str:
         return f"Call({self.parameters}, {self.left})"
 
+def mark_tail_calls(node):
+    # Follows the value of a function body through Returns, Ifs and Scopes down
+    # to a Call whose result is returned as is. That call is in tail position
+    # and can reuse the caller's frame instead of stacking a new one.
+    while True:
+        if type(node) == Call:
+            node.tail = True
+            return
+        elif type(node) == Return:
+            node = node.token
+        elif type(node) == If:
+            node = node.result
+        elif type(node) == Scope:
+            for statement in node.statements:
+                if type(statement) == Return:
+                    node = statement
+                    break
+            else:
+                return
+        else:
+            return
+
 class Parameters(AST):
     def __init__(self, identifiers: list = None) -> None:
         if identifiers == None: identifiers = []
@@ -160,61 +258,133 @@ class Tuple(Value):
         return f"Tuple({', '.join(values)})"
 
 class Function(Value):
-    def __init__(self, parameters: Parameters | FunctionType, scope: Scope = None) -> None:
+    # None until the first call decides between a Memo and False
+    memo = None
+
+    def __init__(self, parameters: Parameters | FunctionType, scope: Scope = None, env: Environment = None) -> None:
         if type(parameters) == FunctionType:
             self.scope = parameters
         else:
             self.parameters = parameters
             self.scope = scope
+            self.env = env
 
     def call(self, params):
         if type(self.scope) == FunctionType:
             return_value = self.scope(*params)
-            if return_value == None:
-                return Nil(0)
+            if return_value is None:
+                return NIL
             return return_value
         else:
             parameters, scope = self.parameters, self.scope
 
-            variables = {}
+            variables = Environment(self.env)
 
             index = 0
             for p in parameters.identifiers:
-                if index >= len(params.values):
-                    self.error("Not enough parameters entered")
-                value = params.values[index]
+                if index >= len(params):
+                    return Error(String("Not enough parameters entered"))
+                value = params[index]
 
                 variables[p.value] = value
                 index += 1
 
-            scope.vars = variables
-            return scope
+            return Frame(scope, variables)
     
     def __repr__(self) -> str:
         return f"Function({self.scope})"
 
+# Runtime values carry no Token; oindex is only kept for literals from the parser.
 class String(Value):
-    def __init__(self, token) -> None:
-        self.token = token
-        self.value = token.value
+    __slots__ = ('value', 'oindex')
+
+    def __init__(self, value: str, oindex: int = 0) -> None:
+        self.value = value
+        self.oindex = oindex
 
     def string(self) -> str:
         return self.value
 
     def bool(self) -> bool:
         return self.value != ''
+
+    def __len__(self) -> int:
+        return len(self.value)
     
     def op_PLUS(self, other):
-        val = self.value + other.value
-        return String(Token("STRING", val, self.token.oindex))
+        if type(other) == String:
+            if len(self.value) + len(other.value) < ROPE_THRESHOLD:
+                return String(self.value + other.value)
+            return Rope([self.value, other.value], 2, len(self.value) + len(other.value))
+        elif type(other) == Rope:
+            parts = other.parts[:other.count]
+            parts.insert(0, self.value)
+            return Rope(parts, len(parts), len(self.value) + other.length)
+        return String(self.value + other.value)
 
     def __repr__(self) -> str:
-        return f"String({self.token})"
+        return f"String({Token('STRING', self.value, self.oindex)})"
+
+# Concatenations at least this long become a Rope instead of a new str
+ROPE_THRESHOLD = 256
+
+class Rope(String):
+    # A String built by +, kept as the list of pieces that make it up and only
+    # joined once its contents are read. The first count parts are this
+    # rope's. Appending to the newest rope of a list reuses the list, so
+    # building a string piece by piece costs O(1) per +. Appending to an older
+    # rope copies its own parts first, leaving the newer ones untouched.
+    __slots__ = ('parts', 'count', 'length', 'joined')
+
+    def __init__(self, parts: list, count: int, length: int, oindex: int = 0) -> None:
+        self.parts = parts
+        self.count = count
+        self.length = length
+        self.joined = None
+        self.oindex = oindex
+
+    @property
+    def value(self) -> str:
+        if self.joined is None:
+            self.joined = ''.join(self.parts[:self.count])
+        return self.joined
+
+    def string(self) -> str:
+        return self.value
+
+    def bool(self) -> bool:
+        return self.length != 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def extend(self, pieces: list, length: int):
+        parts = self.parts
+        if len(parts) != self.count:
+            parts = parts[:self.count]
+        parts.extend(pieces)
+        return Rope(parts, len(parts), self.length + length)
+
+    def op_PLUS(self, other):
+        if type(other) == String:
+            return self.extend([other.value], len(other.value))
+        elif type(other) == Rope:
+            return self.extend(other.parts[:other.count], other.length)
+        return String(self.value + other.value)
+
+    def __reduce__(self):
+        # Pickled as the plain String it stands for
+        return (String, (self.value,))
+
+    def __repr__(self) -> str:
+        return f"Rope({self.length} chars in {self.count} parts)"
 
 class Bool(Value):
-    def __init__(self, token) -> None:
-        self.token = token
-        self.value = token.value
+    __slots__ = ('value', 'oindex')
+
+    def __init__(self, value: bool, oindex: int = 0) -> None:
+        self.value = value
+        self.oindex = oindex
 
     def string(self) -> str:
         if self.value: return "true"
@@ -224,12 +394,14 @@ class Bool(Value):
         return self.value
     
     def __repr__(self) -> str:
-        return f"Bool({self.token})"
+        return f"Bool({Token('BOOL', self.value, self.oindex)})"
 
 class Num(Value):
-    def __init__(self, token) -> None:
-        self.token = token
-        self.value = token.value
+    __slots__ = ('value', 'oindex')
+
+    def __init__(self, value: float, oindex: int = 0) -> None:
+        self.value = value
+        self.oindex = oindex
     
     def string(self) -> str:
         if self.value.is_integer(): return str(int(self.value))
@@ -239,48 +411,75 @@ class Num(Value):
         return self.value != 0
     
     def op_POS(self):
-        val = +self.value
-        return Num(Token("NUMBER", val, self.token.oindex))
+        return number(+self.value)
 
     def op_NEG(self):
-        val = -self.value
-        return Num(Token("NUMBER", val, self.token.oindex))
+        return number(-self.value)
 
     def op_PLUS(self, other):
-        val = self.value + other.value
-        return Num(Token("NUMBER", val, self.token.oindex))
+        return number(self.value + other.value)
     
     def op_MINUS(self, other):
-        val = self.value - other.value
-        return Num(Token("NUMBER", val, self.token.oindex))
+        return number(self.value - other.value)
     
     def op_MUL(self, other):
-        val = self.value * other.value
-        return Num(Token("NUMBER", val, self.token.oindex))
+        return number(self.value * other.value)
 
     def op_DIV(self, other):
-        val = self.value / other.value
-        return Num(Token("NUMBER", val, self.token.oindex))
+        return number(self.value / other.value)
     
     def op_DIVDIV(self, other):
-        val = self.value // other.value
-        return Num(Token("NUMBER", val, self.token.oindex))
+        return number(self.value // other.value)
 
     def op_MOD(self, other):
-        val = self.value % other.value
-        return Num(Token("NUMBER", val, self.token.oindex))
+        return number(self.value % other.value)
 
     def op_EXP(self, other):
-        val = self.value ** other.value
-        return Num(Token("NUMBER", val, self.token.oindex))
+        return number(self.value ** other.value)
+
+    def op_DOTDOT(self, other):
+        if type(other) != Num:
+            raise OperationError(f"Invalid operation Num .. {type(other).__name__}")
+        return Range(self.value, other.value)
+
+    def __repr__(self) -> str:
+        return f"Num({Token('NUMBER', self.value, self.oindex)})"
+
+class Range(Value):
+    # start..stop, counting up by one and stopping before stop. Only the ends
+    # are stored, the numbers are made one at a time while a loop runs.
+    __slots__ = ('start', 'stop', 'oindex')
+
+    def __init__(self, start: float, stop: float, oindex: int = 0) -> None:
+        self.start = start
+        self.stop = stop
+        self.oindex = oindex
+
+    @property
+    def value(self):
+        return (self.start, self.stop)
+
+    def string(self) -> str:
+        return f"{number(self.start).string()}..{number(self.stop).string()}"
+
+    def bool(self) -> bool:
+        return self.start < self.stop
+
+    def iterate(self):
+        start, stop = self.start, self.stop
+        if start.is_integer():
+            return map(number, map(float, range(int(start), math.ceil(stop))))
+        return map(number, takewhile(lambda value: value < stop, count(start)))
 
     def __repr__(self) -> str:
-        return f"Num({self.token})"
+        return f"Range({self.string()})"
 
 class Nil(Value):
+    __slots__ = ('oindex',)
+    value = None
+
     def __init__(self, oindex: int = 0) -> None:
-        self.token = Token("NIL", None, oindex)
-        self.value = None
+        self.oindex = oindex
 
     def string(self) -> str:
         return "nil"
@@ -289,7 +488,19 @@ class Nil(Value):
         return False
     
     def __repr__(self) -> str:
-        return f"Nil({self.token.oindex})"
+        return f"Nil({self.oindex})"
+
+# Shared instances for values that are otherwise rebuilt on every operation
+NIL = Nil()
+TRUE = Bool(True)
+FALSE = Bool(False)
+SMALL_NUMBERS = {float(i): Num(float(i)) for i in range(-128, 1025)}
+
+def number(value: float) -> Num:
+    cached = SMALL_NUMBERS.get(value)
+    if cached is None:
+        return Num(value)
+    return cached
 
 class UnaryOp(AST):
     def __init__(self, op, expr) -> None:
@@ -0,0 +1,172 @@
+from src.interpreter import Interpreter
+from src.optimizer import Pass
+from src.sourcemap import SourceMap
+from src.parsetokens import Frame, Function, Var
+from types import GeneratorType
+from time import perf_counter
+
+class FunctionNames(Pass):
+    # Labels the body of every named function with its name and line
+    def __init__(self, profiler) -> None:
+        super().__init__()
+        self.profiler = profiler
+
+    def visit_Assign(self, node):
+        if type(node.right) == Function:
+            # fn statements assign to a Token, let statements to a Var
+            token = node.left.token if type(node.left) == Var else node.left
+            self.profiler.names[node.right.scope] = f"{token.value}:{self.profiler.line(token.oindex)}"
+        return super().visit_Assign(node)
+
+##########################################
+##                                      ##
+##  Profiling Interpreter               ##
+##                                      ##
+##########################################
+
+class ProfilingInterpreter(Interpreter):
+    # The tree interpreter, timing every function activation and every node
+    # it visits. Each function and node type gets a count, an inclusive time
+    # (counted only at the outermost activation, so recursion is not counted
+    # twice) and an exclusive time. Exclusive time is also kept per stack of
+    # function names, for flamegraph tools.
+    def __init__(self, tree, source_map: SourceMap = None) -> None:
+        super().__init__(tree)
+        self.set_source(source_map or SourceMap())
+        self.names = {}
+        self.functions = {}
+        self.nodes = {}
+        self.collapsed = {}
+        self.activations = []
+        self.active = {}
+        self.node_active = {}
+        self.timings = []
+
+    def set_source(self, source_map: SourceMap) -> None:
+        # Lines are looked up in the source of the tree that is run next
+        self.source_map = source_map
+
+    def line(self, oindex: int) -> int:
+        return self.source_map.line(oindex)
+
+    def interpret(self, file: str | list | tuple = '', variables = None):
+        if self.tree is not None:
+            FunctionNames(self).run(self.tree)
+        return super().interpret(file, variables)
+
+    def enter(self, scope) -> None:
+        label = self.names.get(scope)
+        if label is None:
+            label = '<program>' if scope is self.tree else '<anonymous>'
+
+        path = label
+        if self.activations:
+            path = self.activations[-1][3] + ';' + label
+        self.activations.append([label, perf_counter(), 0.0, path])
+        self.active[label] = self.active.get(label, 0) + 1
+
+    def leave(self) -> None:
+        label, start, child, path = self.activations.pop()
+        inclusive = perf_counter() - start
+
+        stats = self.functions.get(label)
+        if stats is None:
+            stats = self.functions[label] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[2] += inclusive - child
+        self.active[label] -= 1
+        if self.active[label] == 0:
+            stats[1] += inclusive
+
+        self.collapsed[path] = self.collapsed.get(path, 0.0) + inclusive - child
+        if self.activations:
+            self.activations[-1][2] += inclusive
+
+    def record(self, name: str, inclusive: float, child: float, timings: list) -> None:
+        stats = self.nodes.get(name)
+        if stats is None:
+            stats = self.nodes[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[2] += inclusive - child
+        if self.node_active.get(name, 0) == 0:
+            stats[1] += inclusive
+        if timings:
+            timings[-1][2] += inclusive
+
+    def evaluate(self, node):
+        # Interpreter.evaluate with a start time and child time kept next to
+        # every generator on the stack
+        visitors = self.visitors
+        node_active = self.node_active
+        stack = self.stack = []
+        timings = self.timings = []
+
+        value = node
+        while True:
+            node_type = type(value)
+            visitor = visitors.get(node_type)
+            if visitor is None:
+                visitor = visitors[node_type] = getattr(self, "visit_" + node_type.__name__, self.generic_visit)
+            start = perf_counter()
+            value = visitor(value)
+
+            if type(value) == GeneratorType:
+                stack.append(value)
+                timings.append([node_type.__name__, start, 0.0])
+                node_active[node_type.__name__] = node_active.get(node_type.__name__, 0) + 1
+                value = None
+            else:
+                self.record(node_type.__name__, perf_counter() - start, 0.0, timings)
+
+            while stack:
+                try:
+                    value = stack[-1].send(value)
+                    break
+                except StopIteration as result:
+                    stack.pop()
+                    name, start, child = timings.pop()
+                    node_active[name] -= 1
+                    self.record(name, perf_counter() - start, child, timings)
+                    value = result.value
+            else:
+                return value
+
+    def visit_Frame(self, frame):
+        frames = self.frames
+        frames.append(frame)
+        self.enter(frame.scope)
+        value = yield from self.statements(frame.scope.statements)
+        while type(value) == Frame:
+            # A tail call ends the caller's activation where the callee's starts
+            self.leave()
+            self.enter(value.scope)
+            frames[-1] = value
+            value = yield from self.statements(value.scope.statements)
+        self.leave()
+        frames.pop()
+        return value
+
+    def finish(self) -> None:
+        # Closes whatever an error left running, so it is still reported
+        while self.activations:
+            self.leave()
+        timings = self.timings
+        while timings:
+            name, start, child = timings.pop()
+            self.node_active[name] -= 1
+            self.record(name, perf_counter() - start, child, timings)
+
+    def report(self, limit: int = 20) -> str:
+        lines = [f"{'function':<28} {'calls':>9} {'incl ms':>11} {'excl ms':>11}"]
+        for label, (calls, inclusive, exclusive) in sorted(self.functions.items(), key=lambda item: item[1][2], reverse=True)[:limit]:
+            lines.append(f"{label:<28} {calls:>9} {inclusive * 1000:>11.3f} {exclusive * 1000:>11.3f}")
+
+        lines.append('')
+        lines.append(f"{'node':<28} {'count':>9} {'incl ms':>11} {'excl ms':>11}")
+        for name, (count, inclusive, exclusive) in sorted(self.nodes.items(), key=lambda item: item[1][2], reverse=True)[:limit]:
+            lines.append(f"{name:<28} {count:>9} {inclusive * 1000:>11.3f} {exclusive * 1000:>11.3f}")
+        return '\n'.join(lines)
+
+    def collapsed_stacks(self) -> str:
+        # One "outer;inner microseconds" line per stack, as flamegraph.pl reads them
+        return '\n'.join(f"{path} {round(seconds * 1000000)}" for path, seconds in sorted(self.collapsed.items()))
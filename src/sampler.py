@@ -0,0 +1,157 @@
+from src.profiler import FunctionNames
+from src.sourcemap import SourceMap
+from src.parsetokens import Frame, Scope
+import threading
+
+# Kinds of generator that pushed a Frame onto Interpreter.frames: a function
+# activation, or a block, which also runs a line of its own
+FRAME = object()
+BLOCK = object()
+
+# Fields followed from a node to the first one that knows where it is in the source
+LOCATION_FIELDS = ('op', 'token', 'var', 'left', 'condition', 'iterable', 'expr', 'right')
+
+def node_oindex(node, depth: int = 8):
+    for _ in range(depth):
+        oindex = getattr(node, 'oindex', None)
+        if oindex is not None:
+            return oindex
+        if type(node) == Scope:
+            if not node.statements:
+                return None
+            node = node.statements[0]
+            continue
+
+        for field in LOCATION_FIELDS:
+            child = getattr(node, field, None)
+            if child is not None:
+                node = child
+                break
+        else:
+            return None
+    return None
+
+##########################################
+##                                      ##
+##  Sampler                             ##
+##                                      ##
+##########################################
+
+class Sampler:
+    # Looks at the generator stack of a running tree interpreter from a
+    # background thread every interval seconds. Each generator is suspended
+    # in the visit_ method of one node, so the stack gives the nodes being
+    # run and, through their Frames, the functions they are in. Nothing is
+    # added to the interpreter itself, so the only cost is the sampling.
+    def __init__(self, interpreter, source_map: SourceMap = None, interval: float = 0.01) -> None:
+        self.interpreter = interpreter
+        self.interval = interval
+        self.set_source(source_map or SourceMap())
+        self.names = {}
+        self.samples = 0
+        self.self_lines = {}
+        self.total_lines = {}
+        self.collapsed = {}
+        self.entries = {}
+        self.tree = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def set_source(self, source_map: SourceMap) -> None:
+        self.source_map = source_map
+
+    def line(self, oindex: int) -> int:
+        return self.source_map.line(oindex)
+
+    def start(self, tree = None) -> None:
+        if tree is None:
+            tree = self.interpreter.tree
+        self.tree = tree
+        if tree is not None:
+            FunctionNames(self).run(tree)
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.entries = {}
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def function_label(self, frame: Frame) -> str:
+        label = self.names.get(frame.scope)
+        if label is None:
+            label = '<program>' if frame.scope is self.tree else '<anonymous>'
+        return label
+
+    def entry(self, generator):
+        # (kind, line), where kind is FRAME or BLOCK for generators that own
+        # one of the interpreter's frames and line is None when unknown
+        frame = generator.gi_frame
+        if frame is None:
+            return (None, None)
+        # The node is the first argument after self of the visit_ method
+        node = frame.f_locals.get(frame.f_code.co_varnames[1])
+        if type(node) == Frame:
+            return (FRAME, None)
+        oindex = node_oindex(node)
+        line = None if oindex is None else self.line(oindex)
+        return (BLOCK if type(node) == Scope else None, line)
+
+    def sample(self) -> None:
+        interpreter = self.interpreter
+        stack = list(getattr(interpreter, 'stack', ()))
+        if not stack:
+            return
+        # Every Frame and block generator pushed one of these, in stack order.
+        # A tail call swaps the Frame in place, so labels are read from here.
+        frames = list(getattr(interpreter, 'frames', ()))
+
+        # Most of a deep stack is still suspended where it was at the last
+        # sample, so entries are kept for the generators seen last time
+        entries = self.entries
+        seen = self.entries = {}
+        functions = []
+        lines = []
+        index = 0
+        for generator in stack:
+            entry = entries.get(generator)
+            if entry is None:
+                entry = self.entry(generator)
+            seen[generator] = entry
+            kind, line = entry
+            if kind is not None:
+                # The generator on top may not have pushed its frame yet
+                if kind is FRAME and index < len(frames):
+                    functions.append(self.function_label(frames[index]))
+                index += 1
+            if line is not None:
+                lines.append(line)
+
+        if not lines:
+            return
+        self.samples += 1
+        self.self_lines[lines[-1]] = self.self_lines.get(lines[-1], 0) + 1
+        for line in set(lines):
+            self.total_lines[line] = self.total_lines.get(line, 0) + 1
+
+        path = ';'.join(functions) + f";line {lines[-1]}"
+        self.collapsed[path] = self.collapsed.get(path, 0) + 1
+
+    def report(self, limit: int = 20) -> str:
+        lines = [f"{self.samples} samples every {self.interval * 1000:g}ms", f"{'line':>6} {'self':>8} {'self %':>7} {'total':>8} {'total %':>7}"]
+        samples = self.samples or 1
+        for line, count in sorted(self.self_lines.items(), key=lambda item: item[1], reverse=True)[:limit]:
+            total = self.total_lines[line]
+            lines.append(f"{line:>6} {count:>8} {count / samples:>7.1%} {total:>8} {total / samples:>7.1%}")
+        return '\n'.join(lines)
+
+    def collapsed_stacks(self) -> str:
+        # One "outer;inner samples" line per stack, as flamegraph.pl reads them
+        return '\n'.join(f"{path} {count}" for path, count in sorted(self.collapsed.items()))
@@ -0,0 +1,116 @@
+import gc, io, os, pickle
+from src.parsetokens import Function, Frame, default_vars
+from src.cache import interpreter_version
+from types import FunctionType
+
+##########################################
+##                                      ##
+##  Snapshot                            ##
+##                                      ##
+##########################################
+
+class SnapshotError(Exception):
+    # A snapshot that can't be saved, or a file that can't be read or is not
+    # a snapshot
+    pass
+
+def restore_function(parameters, scope):
+    # Stands in for the engine's own function type in the pickle, the
+    # SnapshotUnpickler swaps in the engine the snapshot is loaded into
+    return Function(parameters, scope)
+
+class SnapshotPickler(pickle.Pickler):
+    # Builtins are saved by their name and user functions as their parameters,
+    # body and environment, so a snapshot taken on one engine loads on any.
+    # The builtin layer itself is never saved, it is rebuilt on every start.
+    def __init__(self, file) -> None:
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.builtins = {id(value): name for name, value in default_vars.items()}
+
+    def persistent_id(self, obj):
+        if obj is default_vars:
+            return 'default_vars'
+        elif obj is restore_function:
+            return 'function'
+        elif isinstance(obj, Function) and type(obj.scope) == FunctionType:
+            name = self.builtins.get(id(obj))
+            if name is None:
+                raise pickle.PicklingError(f"Cannot snapshot a Python function that is not a builtin: {obj.scope.__name__}")
+            return ('builtin', name)
+        return None
+
+    def reducer_override(self, obj):
+        # Function nodes of the tree have no environment and are saved as they
+        # are. The environment is set after the function is made, since it
+        # usually holds the function itself.
+        if isinstance(obj, Function) and obj.env is not None:
+            return (restore_function, (obj.parameters, obj.scope), {'env': obj.env})
+        return NotImplemented
+
+class SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, file, interpreter) -> None:
+        super().__init__(file)
+        self.interpreter = interpreter
+
+    def make_function(self, parameters, scope):
+        return self.interpreter.make_function(Function(parameters, scope), None)
+
+    def persistent_load(self, pid):
+        if pid == 'default_vars':
+            return default_vars
+        elif pid == 'function':
+            return self.make_function
+        elif pid[0] == 'builtin' and pid[1] in default_vars:
+            return default_vars[pid[1]]
+        raise pickle.UnpicklingError(f"Unknown builtin in snapshot: {pid[1]}")
+
+def save_snapshot(interpreter, path: str) -> None:
+    # Writes the globals of the last run, for load_snapshot to start from.
+    # Globals that can't be saved and files that can't be written raise a
+    # SnapshotError, and leave any earlier snapshot at path as it was.
+    data = io.BytesIO()
+    pickler = SnapshotPickler(data)
+    try:
+        pickler.dump(interpreter_version())
+        pickler.dump(interpreter.global_scope.vars)
+    except RecursionError as ex:
+        raise SnapshotError("globals are nested too deeply to save") from ex
+    except (pickle.PicklingError, TypeError) as ex:
+        raise SnapshotError(str(ex)) from ex
+
+    temporary = path + '.tmp'
+    try:
+        with open(temporary, "wb") as stream:
+            stream.write(data.getbuffer())
+        os.replace(temporary, path)
+    except OSError as ex:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise SnapshotError(ex.strerror or str(ex)) from ex
+
+def load_snapshot(interpreter, path: str) -> bool:
+    # The next feed() of the interpreter runs against the restored globals,
+    # interpret() still starts from fresh ones. Snapshots from another
+    # interpreter version are refused, and a file that can't be read raises
+    # a SnapshotError.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, "rb") as stream:
+            unpickler = SnapshotUnpickler(stream, interpreter)
+            if unpickler.load() != interpreter_version():
+                return False
+            variables = unpickler.load()
+    except OSError as ex:
+        raise SnapshotError(ex.strerror or str(ex)) from ex
+    except Exception as ex:
+        # A damaged pickle can fail with almost any exception
+        raise SnapshotError(f"not a snapshot ({type(ex).__name__})") from ex
+    finally:
+        if enabled:
+            gc.enable()
+
+    interpreter.global_scope = Frame(None, variables)
+    return True
@@ -0,0 +1,29 @@
+from bisect import bisect_right
+import re
+
+NEWLINE = re.compile('\n')
+
+class SourceMap:
+    # The offset every line of a source starts at, so the line and column of
+    # an oindex are a bisect away instead of a count over the text before it.
+    # Text can be added as it is read, and only the offsets are kept.
+    def __init__(self, source: str = '', offset: int = 0) -> None:
+        self.starts = [offset]
+        self.length = offset
+        self.extend(source)
+
+    def extend(self, text: str) -> None:
+        length = self.length + 1
+        self.starts.extend(match.start() + length for match in NEWLINE.finditer(text))
+        self.length += len(text)
+
+    def line(self, oindex: int) -> int:
+        return bisect_right(self.starts, oindex) or 1
+
+    def line_start(self, line: int) -> int:
+        return self.starts[line - 1]
+
+    def locate(self, oindex: int) -> tuple[int, int]:
+        # 1-based line and column
+        line = self.line(oindex)
+        return line, max(oindex - self.starts[line - 1], 0) + 1
@@ -0,0 +1,155 @@
+from src.interpreter import Interpreter, register_value, MAX_DEPTH
+from src.compiler import *
+from src.parsetokens import Function, Environment, Frame, Error, NIL, default_vars
+from src.memo import get_memo
+
+##########################################
+##                                      ##
+##  Virtual Machine                     ##
+##                                      ##
+##########################################
+
+class Closure(Function):
+    def __init__(self, function: Function, code: Code, env: Environment) -> None:
+        self.parameters = function.parameters
+        self.scope = function.scope
+        self.code = code
+        self.env = env
+
+register_value(Closure)
+
+class VM(Interpreter):
+    def __init__(self, tree) -> None:
+        self.tree = tree
+        self.global_scope = None
+
+    def make_function(self, node, env: Environment):
+        return Closure(node, Compiler(None).compile_function(node), env)
+
+    def run(self, code: Code, env: Environment):
+        operate = self.operate
+        error = self.error
+
+        stack = []
+        frames = []
+        envs = []
+        instructions = code.instructions
+        pc = 0
+
+        while True:
+            op, arg = instructions[pc]
+            pc += 1
+
+            if op == LOAD_VAR:
+                try:
+                    stack.append(env[arg])
+                except KeyError:
+                    error(f"Invalid Variable: {arg}")
+            elif op == LOAD_CONST:
+                stack.append(arg)
+            elif op == BINARY_OP:
+                right = stack.pop()
+                stack[-1] = operate(arg, stack[-1], right)
+            elif op == CALL or op == TAIL_CALL:
+                func = stack.pop()
+                if arg:
+                    params = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    params = []
+
+                if type(func) == Closure:
+                    identifiers = func.parameters.identifiers
+                    if len(params) < len(identifiers):
+                        error("Not enough parameters entered")
+
+                    memo = func.memo
+                    if memo is None:
+                        memo = get_memo(func)
+                    key = None
+                    if memo:
+                        key = memo.key(params)
+                        if key is not None:
+                            value = memo.get(key)
+                            if value is not None:
+                                stack.append(value)
+                                continue
+
+                    # A tail call keeps the caller's return frame, so the
+                    # callee's RETURN goes straight back to it and the result
+                    # is stored for whichever call pushed that frame.
+                    if op == CALL:
+                        if len(frames) >= MAX_DEPTH:
+                            error(f"Maximum call depth exceeded ({MAX_DEPTH})")
+                        frames.append((instructions, pc, env, envs, memo, key))
+                    instructions = func.code.instructions
+                    pc = 0
+                    env = Environment(func.env)
+                    for identifier, value in zip(identifiers, params):
+                        env[identifier.value] = value
+                    envs = []
+                elif isinstance(func, Function):
+                    value = func.call(params)
+                    if type(value) == Error:
+                        error(value.token.value)
+                    stack.append(value)
+                else:
+                    error(f"Cannot call {type(func).__name__}")
+            elif op == RETURN:
+                instructions, pc, env, envs, memo, key = frames.pop()
+                if key is not None:
+                    memo.put(key, stack[-1])
+            elif op == FOR_ITER:
+                value = next(stack[-1], None)
+                if value is None:
+                    stack.pop()
+                    pc = arg[0]
+                else:
+                    env[arg[1]] = value
+            elif op == GET_ITER:
+                iterator = stack[-1].iterate()
+                if iterator is None:
+                    error(f"Cannot loop over {type(stack[-1]).__name__}")
+                stack[-1] = iterator
+            elif op == POP:
+                stack.pop()
+            elif op == LOAD_NIL:
+                stack.append(NIL)
+            elif op == JUMP_IF_FALSE:
+                if not stack.pop().bool():
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == ENTER_SCOPE:
+                envs.append(env)
+                if not arg:
+                    env = Environment(env)
+            elif op == EXIT_SCOPE:
+                env = envs.pop()
+            elif op == STORE_VAR:
+                env[arg] = stack[-1]
+            elif op == STORE_PUB:
+                env[arg] = stack[-1]
+                self.global_scope.vars[arg] = stack[-1]
+            elif op == UNARY_OP:
+                stack[-1] = operate(arg, stack[-1])
+            elif op == MAKE_FUNCTION:
+                stack.append(Closure(arg[0], arg[1], env))
+            elif op == REASSIGN:
+                var_name, op_type = arg
+                env[var_name] = operate(op_type, env.lookup(var_name), stack[-1])
+            elif op == HALT:
+                return stack.pop()
+            else:
+                error(f"Invalid opcode: {op}")
+
+    def interpret(self, file: str | list | tuple = '', variables: Environment = None):
+        tree = self.tree
+        if tree is None:
+            return ''
+
+        self.code = Compiler(tree).compile()
+
+        if variables is None: variables = Environment(default_vars)
+        self.global_scope = Frame(tree, variables)
+        return self.run(self.code, self.global_scope.vars)
@@ -0,0 +1,610 @@
+import io, os, re, subprocess, sys, tempfile, unittest
+from contextlib import redirect_stdout
+import src.arrays, src.builtin, src.memo
+import src.libs.output as output
+from src.lexer import Tokenizer, program_map
+from src.sourcemap import SourceMap
+from src.parse import Parser
+from src.optimizer import Optimizer
+from src.interpreter import Interpreter
+from src.vm import VM
+from src.closures import ClosureInterpreter
+from src.cache import ProgramCache
+from src.snapshot import save_snapshot, load_snapshot, SnapshotError
+from src.profiler import ProfilingInterpreter
+from src.sampler import Sampler
+from src.parsetokens import Environment, Function, default_vars
+
+ENGINES = {
+    "tree": Interpreter,
+    "vm": VM,
+    "closure": ClosureInterpreter,
+}
+
+ANSI = re.compile(r'\033\[[0-9;]*m')
+
+def run(source: str, engine: str = "tree", optimize: bool = True) -> str:
+    # Everything the program prints, then the reason of the error that ended
+    # it. Engines title their errors differently, so only the reason is kept.
+    sink = io.StringIO()
+    messages = io.StringIO()
+    output.set_sink(sink)
+    try:
+        with redirect_stdout(messages):
+            tree = Optimizer(enabled=optimize).optimize(Parser(Tokenizer(source)).parse())
+            ENGINES[engine](tree).interpret()
+    except SystemExit:
+        output.flush()
+        lines = [line for line in ANSI.sub('', messages.getvalue()).split('\n') if line]
+        sink.write(f"error: {lines[-1]}\n")
+    finally:
+        output.set_sink(None)
+    return sink.getvalue()
+
+def run_stdout(source: str) -> None:
+    # Runs on the tree engine with output going to the real stdout
+    tree = Parser(Tokenizer(source)).parse()
+    Interpreter(tree).interpret()
+    output.flush()
+
+##########################################
+##                                      ##
+##  Lexer                               ##
+##                                      ##
+##########################################
+
+# Ranges, a lone '.', the loop keywords, comments and strings across lines
+LEXED = """let x = 1.5; # comment
+for i in 0..10 { if i >= 2 and not false { break } else continue };
+while x != nil { pub fn f(a, b) { return a // b ^ 2 % 3 } };
+let s = "one
+two" + 'q' + "esc\\n\\"d";
+x <= .5 == 3. or true; a.b . error
+"""
+
+# (type, value, oindex) of every token in LEXED
+TOKENS = [
+    ('LCURLY', '{', 0),
+    ('LET', None, 1),
+    ('ID', 'x', 5),
+    ('EQUALS', '=', 7),
+    ('NUMBER', 1.5, 9),
+    ('SEMI', ';', 12),
+    ('FOR', None, 24),
+    ('ID', 'i', 28),
+    ('IN', None, 30),
+    ('NUMBER', 0.0, 33),
+    ('DOTDOT', '..', 34),
+    ('NUMBER', 10.0, 36),
+    ('LCURLY', '{', 39),
+    ('IF', None, 41),
+    ('ID', 'i', 44),
+    ('GREATERE', '>=', 46),
+    ('NUMBER', 2.0, 49),
+    ('AND', None, 51),
+    ('NOT', None, 55),
+    ('FALSE', False, 59),
+    ('LCURLY', '{', 65),
+    ('BREAK', None, 67),
+    ('RCURLY', '}', 73),
+    ('ID', 'else', 75),
+    ('CONTINUE', None, 80),
+    ('RCURLY', '}', 89),
+    ('SEMI', ';', 90),
+    ('WHILE', None, 92),
+    ('ID', 'x', 98),
+    ('BANGE', '!=', 100),
+    ('NIL', None, 103),
+    ('LCURLY', '{', 107),
+    ('PUB', None, 109),
+    ('FUNCTION', None, 113),
+    ('ID', 'f', 116),
+    ('LBRACKET', '(', 117),
+    ('ID', 'a', 118),
+    ('COMMA', ',', 119),
+    ('ID', 'b', 121),
+    ('RBRACKET', ')', 122),
+    ('LCURLY', '{', 124),
+    ('RETURN', None, 126),
+    ('ID', 'a', 133),
+    ('DIVDIV', '//', 135),
+    ('ID', 'b', 138),
+    ('EXP', '^', 140),
+    ('NUMBER', 2.0, 142),
+    ('MOD', '%', 144),
+    ('NUMBER', 3.0, 146),
+    ('RCURLY', '}', 148),
+    ('RCURLY', '}', 150),
+    ('SEMI', ';', 151),
+    ('LET', None, 153),
+    ('ID', 's', 157),
+    ('EQUALS', '=', 159),
+    ('STRING', 'one\ntwo', 161),
+    ('PLUS', '+', 171),
+    ('STRING', 'q', 173),
+    ('PLUS', '+', 177),
+    ('STRING', 'esc\n"d', 179),
+    ('SEMI', ';', 189),
+    ('ID', 'x', 191),
+    ('LESSERE', '<=', 193),
+    ('NUMBER', 0.5, 196),
+    ('EQUALSE', '==', 199),
+    ('NUMBER', 3.0, 202),
+    ('OR', None, 205),
+    ('TRUE', True, 208),
+    ('SEMI', ';', 212),
+    ('ID', 'a.b', 214),
+    ('DOT', '.', 218),
+    ('ERROR', None, 220),
+    ('RCURLY', '}', 227),
+    ('EOF', None, 228),
+]
+
+class LexerTest(unittest.TestCase):
+    def test_tokens(self) -> None:
+        tokens = [(token.type, token.value, token.oindex) for token in Tokenizer(LEXED).tokenize()]
+        self.assertEqual(tokens, TOKENS)
+
+    def test_streamed_tokens(self) -> None:
+        # Chunks split tokens, strings and lines at every possible place
+        for size in (1, 2, 3, 7, 64):
+            with self.subTest(size=size):
+                chunks = [LEXED[index:index + size] for index in range(0, len(LEXED), size)]
+                tokens = [(token.type, token.value, token.oindex) for token in Tokenizer(chunks).tokenize()]
+                self.assertEqual(tokens, TOKENS)
+
+##########################################
+##                                      ##
+##  Engines                             ##
+##                                      ##
+##########################################
+
+# Each program should print the same thing on every engine
+PROGRAMS = {
+    "arithmetic": 'print(1 + 2 * 3 - 4 / 2, 2 ^ 10, -5, (1 + 2) * 3)',
+    "comparisons": 'print(1 < 2, 2 <= 1, 3 == 3, "a" != "b", not true, true and false or true)',
+    "strings": 'let s = "ab" + "cd"; print(s, s == "abcd")',
+    "ropes": ('let s = ""; for i in 0..90 { let s = s + "abc" }; let t = s + "x"; let u = s + "y"; '
+              'print(t == u, t == s + "x", u != s); print(t); print(u)'),
+    "scoping": 'let x = 1; { let x = 2; print(x) }; if true { let y = 3 }; print(x, y)',
+    "pub": 'let x = 1; fn set() { pub let x = 5 }; set(); print(x)',
+    "closures": 'fn adder(n) { fn(x) { x + n } }; let add2 = adder(2); let add5 = adder(5); print(add2(3), add5(3))',
+    "recursion": 'fn fib(n) { let r = n; if n > 1 { let r = fib(n - 1) + fib(n - 2) }; r }; print(fib(15))',
+    "return": 'fn f(n) { return n * 2; print("unreachable") }; print(f(4))',
+    "tail calls": 'fn count(n, acc) { if n == 0 { print(acc) }; if n > 0 { count(n - 1, acc + 1) } }; count(5000, 0)',
+    "for": 'let total = 0; for i in 0..5 { let total = total + i }; print(total)',
+    "while": 'let i = 0; while i < 10 { let i = i + 1; if i == 3 { continue }; if i == 6 { break }; print(i) }',
+    "nested loops": 'for i in 0..3 { for j in 0..3 { if j > i { break }; print(i, j) } }',
+    "loop in function": 'fn total(n) { let t = 0; for i in 0..n { let t = t + i }; t }; print(total(4), total(0))',
+    "break in a block": 'for i in 0..3 { { if i == 1 { break } }; print(i) }',
+    "break in an expression": 'for i in 0..3 { print(i, { break }) }',
+    "continue in an expression": 'while true { let x = { continue } }',
+    "undefined variable": 'print(1); print(missing)',
+    "invalid operation": 'print("before"); print(true * 2)',
+    "calling a number": 'let x = 1; print(x); x()',
+    "array of non-numbers": 'print(sum(array(1, 2))); array(1, "a")',
+    "size of a number": 'print(size(array(1, 2))); size(5)',
+    "at of a number": 'print(at(array(4, 5), 1)); at(5, 0)',
+    "at with a string index": 'at(array(1), "x")',
+    "at with a negative index": 'print(at(array(4, 5), 0)); at(array(4, 5), -1)',
+    "at past the end": 'at(array(4, 5), 2)',
+    "arange of a string": 'print(size(arange(0, 3))); arange("a", 3)',
+    "arange with a nil step": 'arange(0, 3, nil)',
+    "arange with a zero step": 'arange(0, 3, 0)',
+    "memo size of a string": 'fn f(x) { x }; let g = memo(f, 2); print(g(1)); memo(f, "x")',
+    "memo size of nil": 'fn f(x) { x }; memo(f, nil)',
+    "negative memo size": 'fn f(x) { x }; memo(f, -1)',
+    "python() timeout of a string": 'python("def main(): return 1", "x")',
+    "python_wait of a string": 'python_wait("x")',
+    "python_wait of nil": 'python_wait(nil)',
+    "array divided by zero": 'print(array(1, 2) / 2); print(array(1, 2) / 0)',
+    "number divided by an array": 'print(2 / array(1, 2)); print(2 / array(1, 0))',
+    "array overflow": 'let b = array(10); print(b ^ 2); let c = array(10 ^ 300); print(c * c)',
+    "array power without a real result": 'print(array(4) ^ 0.5); print(array(-1) ^ 0.5)',
+}
+
+# Programs with Arrays, which should also print the same on both backends
+ARRAY_PROGRAMS = (
+    "array of non-numbers", "size of a number", "at of a number", "at with a negative index", "arange of a string",
+    "array divided by zero", "number divided by an array", "array overflow",
+    "array power without a real result",
+)
+
+class EngineTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.memo_size = src.memo.MEMO_SIZE
+
+    def tearDown(self) -> None:
+        src.memo.MEMO_SIZE = self.memo_size
+
+    def assert_same(self, source: str) -> str:
+        expected = run(source, "tree")
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(run(source, engine), expected)
+        return expected
+
+    def test_programs(self) -> None:
+        for name, source in PROGRAMS.items():
+            with self.subTest(program=name):
+                self.assert_same(source)
+
+    def test_ropes(self) -> None:
+        # s is a Rope past 256 characters, and t and u both extend it
+        s = "abc" * 90
+        self.assertEqual(run(PROGRAMS["ropes"]), f"false true true\n{s}x\n{s}y\n")
+
+    def test_deep_recursion(self) -> None:
+        # The closure engine recurses in Python, so it stops earlier than the
+        # others but still reports it as an error
+        source = 'fn count(n) { let r = 0; if n > 0 { let r = 1 + count(n - 1) }; r }; print(count(%d))'
+        self.assert_same(source % 20000)
+        self.assertEqual(run(source % 90000, "closure"),
+                         "error: Maximum call depth exceeded (closure engine, 400000 Python frames)\n")
+
+    def test_redefined_callee(self) -> None:
+        # f is memoized as pure, until the g it calls is replaced
+        src.memo.MEMO_SIZE = 1024
+        source = ('fn g(x) { x + 1 }; fn f(x) { g(x) }; print(f(1)); '
+                  'fn g(x) { x + 100 }; print(f(1)); '
+                  'fn g(x) { print("side"); x }; print(f(1)); print(f(1))')
+        self.assertEqual(self.assert_same(source), "2\n101\nside\n1\nside\n1\n")
+
+    def test_conditional_locals(self) -> None:
+        # limit is only bound when the if or loop body runs, so f reads the
+        # global and must not be memoized
+        src.memo.MEMO_SIZE = 1024
+        source = ('let limit = 5; fn f(x) { if x > 100 { let limit = 0 }; x + limit }; '
+                  'print(f(1)); let limit = 10; print(f(1))')
+        self.assertEqual(self.assert_same(source), "6\n11\n")
+        source = ('let limit = 5; fn f(x) { for i in 0..x { let limit = i }; limit }; '
+                  'print(f(0)); let limit = 10; print(f(0))')
+        self.assertEqual(self.assert_same(source), "5\n10\n")
+
+    def test_array_backends(self) -> None:
+        if not src.arrays.load_numpy():
+            self.skipTest("NumPy is not installed")
+        for name in ARRAY_PROGRAMS:
+            with self.subTest(program=name):
+                expected = run(PROGRAMS[name])
+                src.arrays.USE_NUMPY = False
+                try:
+                    self.assertEqual(run(PROGRAMS[name]), expected)
+                finally:
+                    src.arrays.USE_NUMPY = True
+
+    def test_unoptimized(self) -> None:
+        for name, source in PROGRAMS.items():
+            with self.subTest(program=name):
+                self.assertEqual(run(source, optimize=False), run(source))
+
+##########################################
+##                                      ##
+##  Sessions                            ##
+##                                      ##
+##########################################
+
+# Entries of one REPL session, the second ends in an error
+ENTRIES = (
+    'let x = 40; fn add(n) { n + x }',
+    'print(add(1)); print(missing)',
+    'let y = add(2); print(y, x)',
+)
+
+class SessionTest(unittest.TestCase):
+    def test_feed(self) -> None:
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                interpreter = engine(None)
+                sink = io.StringIO()
+                output.set_sink(sink)
+                try:
+                    for entry in ENTRIES:
+                        tree = Parser(Tokenizer(entry)).parse()
+                        # main.py only ends the entry on an error, not the session
+                        try:
+                            with redirect_stdout(io.StringIO()):
+                                interpreter.feed(tree)
+                        except SystemExit:
+                            pass
+                finally:
+                    output.set_sink(None)
+                self.assertEqual(sink.getvalue(), "41\n42 40\n")
+
+##########################################
+##                                      ##
+##  Output                              ##
+##                                      ##
+##########################################
+
+class RecordingSink:
+    # Keeps every write on its own, to see where the buffer was flushed
+    def __init__(self) -> None:
+        self.writes = []
+
+    def write(self, text: str) -> None:
+        self.writes.append(text)
+
+class OutputTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.buffer_size = output.BUFFER_SIZE
+        self.sink = RecordingSink()
+        output.set_sink(self.sink)
+
+    def tearDown(self) -> None:
+        output.set_sink(None)
+        output.BUFFER_SIZE = self.buffer_size
+
+    def interpret(self, source: str) -> None:
+        Interpreter(Parser(Tokenizer(source)).parse()).interpret()
+
+    def test_unbuffered(self) -> None:
+        output.BUFFER_SIZE = 0
+        self.interpret('print(1); print(2)')
+        self.assertEqual(self.sink.writes, ["1\n", "2\n"])
+
+    def test_buffered_until_exit(self) -> None:
+        output.BUFFER_SIZE = 1 << 16
+        self.interpret('print(1); print(2)')
+        self.assertEqual(self.sink.writes, [])
+        output.flush()
+        self.assertEqual(self.sink.writes, ["1\n2\n"])
+
+    def test_chunks(self) -> None:
+        # Written out each time the buffer holds at least 4 characters
+        output.BUFFER_SIZE = 4
+        self.interpret('print("ab"); print("cd"); print("e")')
+        self.assertEqual(self.sink.writes, ["ab\ncd\n"])
+        output.flush()
+        self.assertEqual(self.sink.writes, ["ab\ncd\n", "e\n"])
+
+    def test_flush_builtin(self) -> None:
+        output.BUFFER_SIZE = 1 << 16
+        self.interpret('print(1); flush(); print(2)')
+        self.assertEqual(self.sink.writes, ["1\n"])
+
+    def test_flush_before_error(self) -> None:
+        # Errors are printed straight to stdout, after what the program printed
+        output.BUFFER_SIZE = 1 << 16
+        stream = io.StringIO()
+        output.set_sink(stream)
+        with redirect_stdout(stream), self.assertRaises(SystemExit):
+            self.interpret('print("before"); print(missing)')
+        text = ANSI.sub('', stream.getvalue())
+        self.assertLess(text.index("before"), text.index("Invalid Variable: missing"))
+
+##########################################
+##                                      ##
+##  Python                              ##
+##                                      ##
+##########################################
+
+COUNTER = """count = 0
+def main():
+    global count
+    count += 1
+    return count"""
+
+class PythonTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.persist = src.builtin.PYTHON_PERSIST
+
+    def tearDown(self) -> None:
+        src.builtin.PYTHON_PERSIST = self.persist
+        src.builtin.python_mains.clear()
+
+    def test_persist(self) -> None:
+        # The source is compiled once either way, but its namespace and so
+        # count are only kept between calls with PYTHON_PERSIST on
+        source = f'print(python("{COUNTER}"), python("{COUNTER}"))'
+        for persist, expected in ((False, "1 1\n"), (True, "1 2\n")):
+            with self.subTest(persist=persist):
+                src.builtin.PYTHON_PERSIST = persist
+                src.builtin.python_mains.clear()
+                src.builtin.python_code.clear()
+                self.assertEqual(run(source), expected)
+                self.assertEqual(list(src.builtin.python_code), [COUNTER])
+                self.assertEqual(len(src.builtin.python_mains), int(persist))
+
+##########################################
+##                                      ##
+##  Python Pool                         ##
+##                                      ##
+##########################################
+
+SLEEPER = """def main():
+    import time
+    time.sleep(5)"""
+
+class PythonPoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.workers = src.builtin.PYTHON_WORKERS
+        src.builtin.PYTHON_WORKERS = 2
+
+    def tearDown(self) -> None:
+        if src.builtin.python_pool is not None:
+            src.builtin.python_pool.close()
+            src.builtin.python_pool = None
+        src.builtin.PYTHON_WORKERS = self.workers
+
+    def test_timeout(self) -> None:
+        source = f'print("before"); python("{SLEEPER}", 0.2)'
+        self.assertEqual(run(source), "before\nerror: python() timed out after 0.2s\n")
+
+    def test_two_jobs(self) -> None:
+        source = (
+            'let a = python_start("def main():\n    return 1");\n'
+            'let b = python_start("def main():\n    return 2");\n'
+            'print(python_wait(b), python_wait(a))'
+        )
+        self.assertEqual(run(source), "2 1\n")
+
+    def test_unknown_job(self) -> None:
+        self.assertEqual(run('python_wait(7)'), "error: No python() job 7\n")
+
+    def test_output_order(self) -> None:
+        # Workers print to the real stdout, so this runs in its own process
+        program = 'print("before"); print(python("def main():\n    print(\'from snippet\')\n    return 1"))'
+        script = (
+            "import sys, src.builtin\n"
+            "src.builtin.PYTHON_WORKERS = 2\n"
+            "from test import run_stdout\n"
+            "run_stdout(sys.argv[1])\n"
+        )
+        result = subprocess.run([sys.executable, "-c", script, program], capture_output=True, text=True, timeout=60,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout, "before\nfrom snippet\n1\n")
+
+##########################################
+##                                      ##
+##  Program Cache                       ##
+##                                      ##
+##########################################
+
+class CacheTest(unittest.TestCase):
+    def test_unwritable_directory(self) -> None:
+        # A cache directory below a regular file can never be created
+        with tempfile.TemporaryDirectory() as directory:
+            blocker = os.path.join(directory, "file")
+            open(blocker, "w").close()
+            cache = ProgramCache(os.path.join(blocker, "cache"))
+            tree = Parser(Tokenizer('print(1)')).parse()
+            self.assertFalse(cache.store("test.lt", "key", tree))
+
+##########################################
+##                                      ##
+##  Snapshots                           ##
+##                                      ##
+##########################################
+
+class SnapshotTest(unittest.TestCase):
+    def test_feed_after_load(self) -> None:
+        setup = Parser(Tokenizer('let base = 40; fn add(x) { x + base }')).parse()
+        program = Parser(Tokenizer('print(add(2))')).parse()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "setup.lts")
+            for engine in ENGINES.values():
+                with self.subTest(engine=engine.__name__):
+                    interpreter = engine(setup)
+                    interpreter.interpret()
+                    save_snapshot(interpreter, path)
+
+                    restored = engine(None)
+                    self.assertTrue(load_snapshot(restored, path))
+                    sink = io.StringIO()
+                    output.set_sink(sink)
+                    try:
+                        restored.feed(program)
+                    finally:
+                        output.set_sink(None)
+                    self.assertEqual(sink.getvalue(), "42\n")
+
+    def test_unpicklable_global(self) -> None:
+        # A Python function handed back by python() is not a builtin
+        interpreter = Interpreter(Parser(Tokenizer('let f = python("def main():\n    return lambda: 1")')).parse())
+        interpreter.interpret()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "setup.lts")
+            with self.assertRaises(SnapshotError):
+                save_snapshot(interpreter, path)
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_unreadable(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "setup.lts")
+            with self.assertRaises(SnapshotError):
+                load_snapshot(Interpreter(None), path)
+            with open(path, "wb") as stream:
+                stream.write(b"not a snapshot")
+            with self.assertRaises(SnapshotError):
+                load_snapshot(Interpreter(None), path)
+
+##########################################
+##                                      ##
+##  Source Map                          ##
+##                                      ##
+##########################################
+
+# Lines start at offsets 0, 3, 6 (an empty line) and 7
+MAPPED = "ab\ncd\n\nef"
+
+class SourceMapTest(unittest.TestCase):
+    def test_locate(self) -> None:
+        source_map = SourceMap(MAPPED)
+        self.assertEqual(source_map.starts, [0, 3, 6, 7])
+        # Line starts, then the last character of a line, which is its newline
+        for oindex, position in ((0, (1, 1)), (3, (2, 1)), (6, (3, 1)), (7, (4, 1)),
+                                 (1, (1, 2)), (2, (1, 3)), (5, (2, 3)), (8, (4, 2))):
+            with self.subTest(oindex=oindex):
+                self.assertEqual(source_map.locate(oindex), position)
+        # Anything past the end is on the last line
+        self.assertEqual(source_map.locate(100), (4, 94))
+
+    def test_program_offset(self) -> None:
+        # Token oindexes count the '{' the Tokenizer puts before a program
+        source_map = program_map(MAPPED)
+        self.assertEqual(source_map.starts, [1, 4, 7, 8])
+        for oindex, position in ((0, (1, 1)), (1, (1, 1)), (3, (1, 3)), (4, (2, 1)),
+                                 (6, (2, 3)), (7, (3, 1)), (8, (4, 1)), (100, (4, 93))):
+            with self.subTest(oindex=oindex):
+                self.assertEqual(source_map.locate(oindex), position)
+
+        tokens = Tokenizer(MAPPED).tokenize()
+        self.assertEqual([source_map.locate(token.oindex) for token in tokens[1:-2]], [(1, 1), (2, 1), (4, 1)])
+
+    def test_extend(self) -> None:
+        source_map = program_map('')
+        for index in range(0, len(MAPPED), 2):
+            source_map.extend(MAPPED[index:index + 2])
+        self.assertEqual(source_map.starts, program_map(MAPPED).starts)
+        self.assertEqual(source_map.length, len(MAPPED) + 1)
+
+##########################################
+##                                      ##
+##  Profilers                           ##
+##                                      ##
+##########################################
+
+PROFILED = """fn double(x) { x * 2 };
+let triple = fn(x) { x * 3 };
+print(double(1), triple(1))"""
+
+class ProfilerTest(unittest.TestCase):
+    def test_function_labels(self) -> None:
+        tokenizer = Tokenizer(PROFILED)
+        tree = Parser(tokenizer).parse()
+        profiler = ProfilingInterpreter(tree, tokenizer.source_map)
+        output.set_sink(io.StringIO())
+        try:
+            profiler.interpret()
+        finally:
+            output.set_sink(None)
+        profiler.finish()
+        self.assertIn("double:1", profiler.functions)
+        self.assertIn("triple:2", profiler.functions)
+
+    def test_sampled_stacks(self) -> None:
+        # probe() takes a sample from inside the program, so the stack is known
+        source = """fn inner() { probe() };
+fn middle() { let r = 0; if true { let r = inner() }; r };
+fn outer() { middle() };
+{ outer() }"""
+        tokenizer = Tokenizer(source)
+        tree = Parser(tokenizer).parse()
+        interpreter = Interpreter(tree)
+        # Never wakes up on its own before stop()
+        sampler = Sampler(interpreter, tokenizer.source_map, interval=3600)
+
+        variables = Environment(default_vars)
+        variables["probe"] = Function(lambda: sampler.sample())
+        sampler.start(tree)
+        try:
+            interpreter.interpret(variables=variables)
+        finally:
+            sampler.stop()
+        # outer() is a tail call, so middle runs in its place
+        self.assertEqual(sampler.collapsed, {"<program>;middle:2;inner:1;line 1": 1})
+
+if __name__ == "__main__":
+    sys.setrecursionlimit(10000)
+    unittest.main()